@@ -15,6 +15,7 @@ from world_boss.app.config import config
 from world_boss.app.enums import NetworkType
 from world_boss.app.kms import signer
 from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
+from world_boss.app.raid import warm_raid_rewards_cache
 
 
 @pytest.fixture()
@@ -27,6 +28,194 @@ def test_raid_rewards_404(fx_test_client, redisdb, fx_session):
     assert req.status_code == 404
 
 
+def test_raid_rewards_cached(fx_test_client, redisdb, fx_world_boss_rewards):
+    reward = fx_world_boss_rewards[0]
+    url = f"/raid/{reward.raid_id}/{reward.avatar_address}/rewards"
+    cache_key = f"raid_rewards_{reward.avatar_address}_{reward.raid_id}_json"
+    req = fx_test_client.get(url)
+    assert req.status_code == 200
+    assert req.headers.get("x-world-boss-service-response-cached") is None
+    assert json.loads(redisdb.get(cache_key)) == req.json()
+
+    cached_value = b'{"cached": true}'
+    redisdb.set(cache_key, cached_value)
+    req = fx_test_client.get(url)
+    assert req.status_code == 200
+    assert req.content == cached_value
+    assert req.headers["content-type"] == "application/json"
+    assert req.headers["x-world-boss-service-response-cached"] == cache_key
+
+
+def test_metrics(fx_test_client, redisdb, fx_world_boss_rewards):
+    reward = fx_world_boss_rewards[0]
+    url = f"/raid/{reward.raid_id}/{reward.avatar_address}/rewards"
+    fx_test_client.get(url)
+    fx_test_client.get(url)
+    req = fx_test_client.get("/metrics")
+    assert req.status_code == 200
+    assert req.headers["content-type"].startswith("text/plain")
+    assert "# TYPE world_boss_cache_hits_total counter" in req.text
+    assert 'world_boss_cache_hits_total{family="reward",tier="redis"}' in req.text
+    assert 'world_boss_cache_misses_total{family="reward"}' in req.text
+    assert (
+        'world_boss_cache_operation_seconds_count{family="reward",operation="get"}'
+        in req.text
+    )
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_raid_rewards_etag(
+    fx_test_client, redisdb, fx_world_boss_rewards, cached: bool
+):
+    reward = fx_world_boss_rewards[0]
+    url = f"/raid/{reward.raid_id}/{reward.avatar_address}/rewards"
+    req = fx_test_client.get(url)
+    assert req.status_code == 200
+    etag = req.headers["etag"]
+    if not cached:
+        redisdb.delete(
+            f"raid_rewards_{reward.avatar_address}_{reward.raid_id}_json",
+            f"raid_rewards_{reward.avatar_address}_{reward.raid_id}_etag",
+        )
+
+    req = fx_test_client.get(url, headers={"If-None-Match": f'W/"other", {etag}'})
+    assert req.status_code == 304
+    assert req.headers["etag"] == etag
+    assert not req.content
+
+    req = fx_test_client.get(url, headers={"If-None-Match": '"other"'})
+    assert req.status_code == 200
+    assert req.headers["etag"] == etag
+    assert req.json() == reward.as_dict()
+
+
+def test_raid_rewards_batch(fx_test_client, redisdb, fx_world_boss_rewards):
+    avatar_addresses = [r.avatar_address for r in reversed(fx_world_boss_rewards)]
+    expected = [r.as_dict() for r in reversed(fx_world_boss_rewards)]
+    req = fx_test_client.post(
+        "/raid/1/rewards:batch", json=[f"0x{avatar_addresses[0]}", "unknown"]
+    )
+    assert req.status_code == 200
+    assert req.json() == expected[:1]
+    assert redisdb.exists(f"raid_rewards_{avatar_addresses[0]}_1_json")
+
+    req = fx_test_client.post("/raid/1/rewards:batch", json=avatar_addresses)
+    assert req.status_code == 200
+    assert req.json() == expected
+    for avatar_address in avatar_addresses:
+        assert redisdb.exists(f"raid_rewards_{avatar_address}_1_json")
+
+
+@pytest.mark.parametrize(
+    "params, expected_rankings",
+    [
+        ({}, [1, 2]),
+        ({"after_ranking": 1}, [2]),
+        (
+            {
+                "after_ranking": 1,
+                "after_avatar_address": "0x5Ea5755eD86631a4D086CC4Fae41740C8985F1B4",
+            },
+            [2],
+        ),
+        ({"after_ranking": 2}, []),
+    ],
+)
+def test_raid_rewards_export(
+    fx_test_client, fx_world_boss_rewards, params: dict, expected_rankings: list
+):
+    req = fx_test_client.get("/raid/1/rewards/export", params=params)
+    assert req.status_code == 200
+    assert req.headers["content-type"] == "application/x-ndjson"
+    rewards = {r.ranking: r.as_dict() for r in fx_world_boss_rewards}
+    assert [json.loads(line) for line in req.iter_lines()] == [
+        rewards[ranking] for ranking in expected_rankings
+    ]
+
+
+@pytest.mark.parametrize(
+    "start, stop, expected_rankings",
+    [(1, 2, [1, 2]), (2, 100, [2]), (3, 100, [])],
+)
+def test_raid_rankings(
+    fx_test_client,
+    redisdb,
+    fx_session,
+    fx_world_boss_rewards,
+    start: int,
+    stop: int,
+    expected_rankings: list,
+):
+    warm_raid_rewards_cache(
+        1, [r.avatar_address for r in fx_world_boss_rewards], fx_session
+    )
+    avatar_addresses = {r.ranking: r.avatar_address for r in fx_world_boss_rewards}
+    req = fx_test_client.get("/raid/1/rankings", params={"start": start, "stop": stop})
+    assert req.status_code == 200
+    assert req.json() == [
+        {"avatarAddress": avatar_addresses[ranking], "ranking": ranking}
+        for ranking in expected_rankings
+    ]
+
+
+def test_raid_rankings_backfill(fx_test_client, redisdb, fx_world_boss_rewards):
+    # rewards synced before the leaderboard was kept in redis
+    req = fx_test_client.get("/raid/1/rankings")
+    assert req.status_code == 200
+    assert req.json() == [
+        {"avatarAddress": r.avatar_address, "ranking": r.ranking}
+        for r in fx_world_boss_rewards
+    ]
+    assert redisdb.zcard("raid_rankings_1") == len(fx_world_boss_rewards)
+
+
+def test_raid_rankings_no_rewards(fx_test_client, redisdb, fx_session):
+    req = fx_test_client.get("/raid/2/rankings")
+    assert req.status_code == 200
+    assert req.json() == []
+    # the season is not queried again
+    with unittest.mock.patch("world_boss.app.raid.backfill_raid_rankings") as m:
+        req = fx_test_client.get("/raid/2/rankings")
+        m.assert_not_called()
+    assert req.json() == []
+
+
+@pytest.mark.parametrize("start, stop", [(2, 1), (1, 1001)])
+def test_raid_rankings_invalid_range(fx_test_client, redisdb, start: int, stop: int):
+    req = fx_test_client.get("/raid/1/rankings", params={"start": start, "stop": stop})
+    assert req.status_code == 400
+
+
+@pytest.mark.parametrize("raid_id", [None, 1, 2])
+def test_agent_rewards(
+    fx_test_client, redisdb, fx_session, fx_world_boss_rewards, raid_id
+):
+    reward = fx_world_boss_rewards[0]
+    url = f"/agent/{reward.agent_address}/rewards"
+    params = {} if raid_id is None else {"raid_id": raid_id}
+    expected = [] if raid_id == 2 else [reward.as_dict()]
+    season = "all" if raid_id is None else raid_id
+    cache_key = f"agent_rewards_{reward.agent_address}_{season}_json"
+    req = fx_test_client.get(url, params=params)
+    assert req.status_code == 200
+    assert req.json() == expected
+    assert redisdb.exists(cache_key)
+
+    req = fx_test_client.get(url, params=params)
+    assert req.json() == expected
+    assert req.headers["x-world-boss-service-response-cached"] == cache_key
+
+    warm_raid_rewards_cache(1, [reward.avatar_address], fx_session)
+    assert redisdb.exists(cache_key) == (raid_id == 2)
+
+
+def test_raid_rewards_batch_too_large(fx_test_client, redisdb, fx_session):
+    req = fx_test_client.post(
+        "/raid/1/rewards:batch", json=[str(i) for i in range(1001)]
+    )
+    assert req.status_code == 400
+
+
 @pytest.mark.skip("duplicate graphql test")
 @pytest.mark.parametrize(
     "caching",
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+from prometheus_client import REGISTRY
+
+from world_boss.app.cache import (
+    COMPRESSED_HEADER,
+    LOCAL_CACHE_INVALIDATION_CHANNEL,
+    LocalCache,
+    cache_exists,
+    compression_stats,
+    get_from_cache,
+    get_key_family,
+    get_many,
+    get_many_early_refresh,
+    set_many,
+    set_to_cache,
+    single_flight,
+    single_flight_async,
+)
+
+
+def test_single_flight(redisdb):
+    key = "single_flight"
+    calls = []
+
+    def build() -> bytes:
+        calls.append(key)
+        time.sleep(0.3)
+        set_to_cache(key, b"value")
+        return b"value"
+
+    def load():
+        return get_from_cache(key)
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(single_flight, key, build, load) for _ in range(5)]
+        results = [f.result() for f in futures]
+    assert results == [b"value"] * 5
+    assert len(calls) == 1
+    assert not cache_exists(f"{key}_lease")
+
+
+def test_single_flight_without_value(redisdb):
+    key = "single_flight"
+    calls = []
+
+    def build():
+        calls.append(key)
+        time.sleep(0.2)
+        return None
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(single_flight, key, build, lambda: None) for _ in range(2)
+        ]
+        results = [f.result() for f in futures]
+    # waiter builds on its own when the lease holder didn't cache a value
+    assert results == [None, None]
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_async(redisdb):
+    key = "single_flight"
+    calls = []
+
+    async def build() -> bytes:
+        calls.append(key)
+        await asyncio.sleep(0.3)
+        set_to_cache(key, b"value")
+        return b"value"
+
+    def load():
+        return get_from_cache(key)
+
+    results = await asyncio.gather(
+        *[single_flight_async(key, build, load) for _ in range(5)]
+    )
+    assert results == [b"value"] * 5
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_async_load_off_loop(redisdb):
+    key = "single_flight"
+    redisdb.set(f"{key}_lease", "other", px=100)
+    threads = []
+
+    async def build() -> bytes:
+        return b"built"
+
+    def load():
+        threads.append(threading.current_thread())
+        return None
+
+    assert await single_flight_async(key, build, load) == b"built"
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_single_flight_lease_timeout(redisdb):
+    key = "single_flight"
+    redisdb.set(f"{key}_lease", "other", px=200)
+    started_at = time.monotonic()
+    result = single_flight(
+        key, lambda: b"built", lambda: None, lease_ttl=timedelta(seconds=1)
+    )
+    assert result == b"built"
+    assert time.monotonic() - started_at < 1
+
+
+def test_get_from_cache(redisdb):
+    assert get_from_cache("key") is None
+    set_to_cache("key", "value")
+    assert get_from_cache("key") == b"value"
+
+
+def test_set_many_with_ttl(redisdb):
+    set_many(
+        {"default": "1", "persist": "2", "short": "3"},
+        {"persist": None, "short": timedelta(seconds=10)},
+    )
+    assert get_many(["default", "persist", "short", "missing"]) == [
+        b"1",
+        b"2",
+        b"3",
+        None,
+    ]
+    assert 0 < redisdb.ttl("default") <= 3600
+    assert redisdb.ttl("persist") == -1
+    assert 0 < redisdb.ttl("short") <= 10
+
+
+def test_local_cache_lru():
+    cache = LocalCache(2, timedelta(minutes=1))
+    cache.set("a", b"1", cache.generation)
+    cache.set("b", b"2", cache.generation)
+    assert cache.get("a") == b"1"
+    cache.set("c", b"3", cache.generation)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+
+
+def test_local_cache_ttl():
+    cache = LocalCache(2, timedelta(seconds=0.1))
+    cache.set("a", b"1", cache.generation)
+    time.sleep(0.2)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_local_cache_stale_generation():
+    cache = LocalCache(2, timedelta(minutes=1))
+    generation = cache.generation
+    cache.delete("a")
+    cache.set("a", b"1", generation)
+    assert cache.get("a") is None
+
+
+def test_get_many_local_cache(redisdb, monkeypatch):
+    local = LocalCache(10, timedelta(minutes=1))
+    monkeypatch.setattr("world_boss.app.cache.local_cache", local)
+    set_to_cache("key", "value")
+    assert get_from_cache("key") == b"value"
+    redisdb.set("key", "changed")
+    # served from the local tier
+    assert get_many(["key", "missing"]) == [b"value", None]
+    set_to_cache("key", "updated")
+    assert get_from_cache("key") == b"updated"
+
+    # invalidation published by another worker
+    redisdb.set("key", "other")
+    redisdb.publish(
+        LOCAL_CACHE_INVALIDATION_CHANNEL,
+        json.dumps({"worker": "other", "keys": ["key"]}),
+    )
+    for _ in range(50):
+        if local.get("key") is None:
+            break
+        time.sleep(0.05)
+    assert get_from_cache("key") == b"other"
+
+
+def test_compressed_value(redisdb):
+    value = json.dumps([{"ranking": i} for i in range(100)])
+    set_to_cache("large", value)
+    set_to_cache("small", "[]")
+    stored = redisdb.get("large")
+    assert stored.startswith(COMPRESSED_HEADER)
+    assert len(stored) < len(value)
+    assert redisdb.get("small") == b"[]"
+    assert get_many(["large", "small"]) == [value.encode(), b"[]"]
+    assert get_from_cache("large") == value.encode()
+    assert compression_stats.ratio > 1
+
+
+def test_uncompressed_legacy_value(redisdb):
+    value = json.dumps([{"ranking": i} for i in range(100)])
+    redisdb.set("legacy", value)
+    assert get_from_cache("legacy") == value.encode()
+
+
+def test_get_many_early_refresh(redisdb):
+    assert get_many_early_refresh(["key"]) == ([None], False)
+    set_many({"key": "value"})
+    assert get_many_early_refresh(["key", "missing"]) == ([b"value", None], False)
+    set_many({"key": "value"}, timedelta(seconds=1), deltas={"key": 10**9})
+    assert get_many_early_refresh(["key"]) == ([b"value"], True)
+    set_many({"key": "value"}, deltas={"key": 0.001})
+    assert get_many_early_refresh(["key"]) == ([b"value"], False)
+
+
+def test_single_flight_stale(redisdb):
+    key = "single_flight"
+    redisdb.set(f"{key}_lease", "other", px=1000)
+    started_at = time.monotonic()
+    result = single_flight(key, lambda: b"built", lambda: None, stale=b"stale")
+    assert result == b"stale"
+    assert time.monotonic() - started_at < 0.5
+
+
+@pytest.mark.parametrize(
+    "key, family",
+    [
+        ("raid_rewards_avatar_1_json", "reward"),
+        ("raid_rewards_1_not_found_g2", "reward"),
+        ("agent_rewards_agent_all_json", "reward"),
+        ("world_boss_1_NetworkType.MAIN_0_500", "ranking_page"),
+        ("world_boss_agents_1_NetworkType.MAIN_0_500", "agent_lookup"),
+        ("raid_rankings_1", "leaderboard"),
+        ("1_uploaded", "upload_marker"),
+        ("raid_1_generation", "generation"),
+        ("unknown", "other"),
+    ],
+)
+def test_get_key_family(key: str, family: str):
+    assert get_key_family(key) == family
+
+
+def test_cache_hit_metrics(redisdb):
+    def sample(name: str, **labels: str) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    hit_labels = {"family": "upload_marker", "tier": "redis"}
+    hits = sample("world_boss_cache_hits_total", **hit_labels)
+    misses = sample("world_boss_cache_misses_total", family="upload_marker")
+    assert not cache_exists("1_uploaded")
+    set_to_cache("1_uploaded", "[]")
+    assert get_many(["1_uploaded", "2_uploaded"]) == [b"[]", None]
+    assert sample("world_boss_cache_hits_total", **hit_labels) == hits + 1
+    assert sample("world_boss_cache_misses_total", family="upload_marker") == misses + 2
@@ -0,0 +1,24 @@
+import pytest
+
+from world_boss.app.config import Settings
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "https://a.test/graphql,https://b.test/graphql",
+        "https://a.test/graphql, https://b.test/graphql,",
+        '["https://a.test/graphql", "https://b.test/graphql"]',
+    ],
+)
+def test_headless_urls(monkeypatch, value: str):
+    monkeypatch.setenv("HEADLESS_URLS", value)
+    assert Settings().headless_urls == [
+        "https://a.test/graphql",
+        "https://b.test/graphql",
+    ]
+
+
+def test_headless_urls_default(monkeypatch):
+    monkeypatch.delenv("HEADLESS_URLS", raising=False)
+    assert Settings().headless_urls == []
@@ -8,7 +8,7 @@ from pytest_redis import factories  # type: ignore
 from starlette.testclient import TestClient
 
 from world_boss.app.config import config
-from world_boss.app.models import Transaction
+from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
 from world_boss.app.orm import Base, SessionLocal, engine
 from world_boss.app.stubs import ActionPlainValue, RewardDictionary
 from world_boss.app.tasks import celery
@@ -159,6 +159,44 @@ def fx_transactions() -> typing.List[Transaction]:
     return transactions
 
 
+@pytest.fixture()
+def fx_world_boss_rewards(
+    fx_session, fx_transactions: typing.List[Transaction]
+) -> typing.List[WorldBossReward]:
+    rewards = []
+    for ranking, (avatar_address, agent_address) in enumerate(
+        [
+            (
+                "5Ea5755eD86631a4D086CC4Fae41740C8985F1B4",
+                "0xC36f031aA721f52532BA665Ba9F020e45437D98D",
+            ),
+            (
+                "01A0b412721b00bFb5D619378F8ab4E4a97646Ca",
+                "0x9EBD1b4F9DbB851BccEa0CFF32926d81eDf6De52",
+            ),
+        ],
+        start=1,
+    ):
+        reward = WorldBossReward()
+        reward.raid_id = 1
+        reward.ranking = ranking
+        reward.avatar_address = avatar_address
+        reward.agent_address = agent_address
+        for transaction, (ticker, decimal_places) in zip(
+            fx_transactions, [("CRYSTAL", 18), ("RUNESTONE_FENRIR1", 0)]
+        ):
+            reward_amount = WorldBossRewardAmount()
+            reward_amount.amount = 100 * ranking
+            reward_amount.ticker = ticker
+            reward_amount.decimal_places = decimal_places
+            reward_amount.transaction = transaction
+            reward_amount.reward = reward
+        fx_session.add(reward)
+        rewards.append(reward)
+    fx_session.commit()
+    return rewards
+
+
 @pytest.fixture()
 def fx_mainnet_transactions() -> typing.List[Transaction]:
     transactions = []
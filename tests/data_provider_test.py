@@ -1,12 +1,21 @@
 import json
-from typing import List
+import threading
+from typing import List, Tuple
 
+import httpx
 import pytest
+from prometheus_client import REGISTRY
 from pytest_httpx import HTTPXMock
 
+from world_boss.app import data_provider
 from world_boss.app.cache import cache_exists, set_to_cache
 from world_boss.app.config import config
-from world_boss.app.data_provider import data_provider_client
+from world_boss.app.data_provider import (
+    AdaptivePageSize,
+    RankingRewardsCollector,
+    RankingRewardsException,
+    data_provider_client,
+)
 from world_boss.app.enums import NetworkType
 from world_boss.app.stubs import RankingRewardDictionary
 
@@ -70,3 +79,178 @@ def test_get_ranking_rewards_error(
     with pytest.raises(Exception):
         data_provider_client.get_ranking_rewards(raid_id, network_type, 0, 1)
     assert not cache_exists(cache_key)
+
+
+@pytest.mark.asyncio
+async def test_get_ranking_rewards_range_async(
+    redisdb, httpx_mock: HTTPXMock, fx_ranking_rewards, monkeypatch
+):
+    raid_id = 1
+    network_type = NetworkType.MAIN
+    requested: List[Tuple[int, int]] = []
+    threads = []
+
+    def record_thread(f):
+        def wrapper(*args):
+            threads.append(threading.current_thread())
+            return f(*args)
+
+        return wrapper
+
+    for name in [
+        "get_ranking_rewards_cache_key",
+        "_get_cached_ranking_rewards",
+        "_cache_ranking_rewards",
+    ]:
+        monkeypatch.setattr(
+            data_provider, name, record_thread(getattr(data_provider, name))
+        )
+
+    def callback(request: httpx.Request) -> httpx.Response:
+        variables = json.loads(request.content)["variables"]
+        offset, limit = variables["offset"], variables["limit"]
+        requested.append((offset, limit))
+        return httpx.Response(
+            200,
+            json={
+                "data": {
+                    "worldBossRankingRewards": [
+                        {
+                            "raider": {"address": f"avatar{i}", "ranking": i + 1},
+                            "rewards": fx_ranking_rewards,
+                        }
+                        for i in range(offset, offset + limit)
+                    ]
+                }
+            },
+        )
+
+    httpx_mock.add_callback(callback, url=config.data_provider_url)
+    cached_page = [{"raider": {"address": "cached", "ranking": 1}, "rewards": []}]
+    set_to_cache(f"world_boss_{raid_id}_{network_type}_0_2", json.dumps(cached_page))
+    pages = await data_provider_client.get_ranking_rewards_range_async(
+        raid_id, network_type, 0, 7, 2, concurrency=2
+    )
+    assert sorted(requested) == [(2, 2), (4, 2), (6, 1)]
+    assert pages[0] == cached_page
+    assert [[r["raider"]["ranking"] for r in page] for page in pages[1:]] == [
+        [3, 4],
+        [5, 6],
+        [7],
+    ]
+    assert cache_exists(f"world_boss_{raid_id}_{network_type}_6_1")
+    # redis is only used off the event loop
+    assert len(threads) == 11
+    assert threading.current_thread() not in threads
+
+
+def test_iter_ranking_rewards(redisdb, httpx_mock: HTTPXMock, monkeypatch):
+    monkeypatch.setattr(
+        "world_boss.app.data_provider.RANKING_REWARDS_RETRY_INTERVAL", 0
+    )
+    raid_id = 1
+    network_type = NetworkType.MAIN
+    requested: List[Tuple[int, int]] = []
+
+    def callback(request: httpx.Request) -> httpx.Response:
+        variables = json.loads(request.content)["variables"]
+        offset, limit = variables["offset"], variables["limit"]
+        requested.append((offset, limit))
+        if requested.count((offset, limit)) == 1 and offset == 2:
+            return httpx.Response(200, json={"errors": [{"message": "timeout"}]})
+        # a short page mid-season
+        if offset == 2:
+            limit = 1
+        return httpx.Response(
+            200,
+            json={
+                "data": {
+                    "worldBossRankingRewards": [
+                        {
+                            "raider": {"address": f"avatar{i}", "ranking": i + 1},
+                            "rewards": [],
+                        }
+                        for i in range(offset, min(offset + limit, 5))
+                    ]
+                }
+            },
+        )
+
+    httpx_mock.add_callback(callback, url=config.data_provider_url)
+    pages = list(
+        data_provider_client.iter_ranking_rewards(
+            raid_id, 2, network_type, total_count=5
+        )
+    )
+    assert [[r["raider"]["ranking"] for r in page] for page in pages] == [
+        [1, 2],
+        [3],
+        [4, 5],
+    ]
+    assert requested == [(0, 2), (2, 2), (2, 2), (3, 2)]
+    assert cache_exists(f"world_boss_{raid_id}_{network_type}_3_2")
+    # without total_count, an empty page ends the season
+    assert list(data_provider_client.iter_ranking_rewards(raid_id, 2)) == pages
+    assert requested[4:] == [(5, 2)]
+
+
+def test_iter_ranking_rewards_error(redisdb, httpx_mock: HTTPXMock, monkeypatch):
+    monkeypatch.setattr(
+        "world_boss.app.data_provider.RANKING_REWARDS_RETRY_INTERVAL", 0
+    )
+    httpx_mock.add_response(
+        method="POST",
+        url=config.data_provider_url,
+        json={"errors": [{"message": "can't receive"}]},
+    )
+    with pytest.raises(RankingRewardsException):
+        list(data_provider_client.iter_ranking_rewards(1, 2, retries=2))
+    assert len(httpx_mock.get_requests()) == 3
+
+
+def test_adaptive_page_size():
+    page_size = AdaptivePageSize(100, 50, 200, 1.0)
+    page_size.record(100, 0.1)
+    assert page_size.size == 150
+    # short pages don't grow the size
+    page_size.record(10, 0.1)
+    assert page_size.size == 150
+    page_size.record(150, 0.1)
+    assert page_size.size == 200
+    page_size.record(200, 2.0)
+    assert page_size.size == 100
+    page_size.record_error()
+    assert page_size.size == 50
+    page_size.record_error()
+    assert page_size.size == 50
+    assert REGISTRY.get_sample_value("world_boss_data_provider_page_size") == 50
+
+
+def test_ranking_rewards_collector():
+    def reward(address: str, ranking: int):
+        return {
+            "raider": {
+                "address": address,
+                "ranking": ranking,
+                "agent_address": "0xC36f031aA721f52532BA665Ba9F020e45437D98D",
+            },
+            "rewards": [],
+        }
+
+    metric = "world_boss_data_provider_duplicate_rewards_total"
+    count = REGISTRY.get_sample_value(metric)
+    collector = RankingRewardsCollector()
+    assert collector.extend([reward("a", 1), reward("b", 2)]) == 0
+    # overlapping page
+    assert collector.extend([reward("b", 2), reward("c", 2), reward("d", 4)]) == 1
+    assert [
+        (r["raider"]["address"], r["raider"]["ranking"]) for r in collector.rewards
+    ] == [
+        ("a", 1),
+        ("b", 2),
+        ("c", 2),
+        ("d", 4),
+    ]
+    assert len(collector) == 4
+    assert collector.duplicates == 1
+    assert REGISTRY.get_sample_value(metric) == count + 1
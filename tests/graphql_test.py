@@ -1,3 +1,4 @@
+from datetime import timedelta
 from decimal import Decimal
 from unittest.mock import MagicMock, patch
 
@@ -5,6 +6,7 @@ import pytest
 from celery.result import AsyncResult
 from pytest_httpx import HTTPXMock
 
+from world_boss.app.cache import LocalCache
 from world_boss.app.config import config
 from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
 
@@ -72,6 +74,7 @@ def test_check_balance(fx_session, fx_test_client):
 @pytest.mark.parametrize("size", [100, 50])
 def test_generate_ranking_rewards_csv(
     fx_test_client,
+    redisdb,
     celery_session_worker,
     httpx_mock: HTTPXMock,
     fx_ranking_rewards,
@@ -98,7 +101,7 @@ def test_generate_ranking_rewards_csv(
         json={
             "data": {
                 "stateQuery": {
-                    "arg01A0b412721b00bFb5D619378F8ab4E4a97646Ca": {
+                    "a0": {
                         "agentAddress": "0x9EBD1b4F9DbB851BccEa0CFF32926d81eDf6De52",
                     },
                 }
@@ -332,3 +335,19 @@ def test_transaction_result(
         assert "world_boss_tx_result" in kwargs["filename"]
         for tx in fx_session.query(Transaction):
             assert tx.tx_result == "INCLUDED"
+
+
+def test_invalidate_raid_cache(fx_test_client, redisdb, monkeypatch):
+    monkeypatch.setattr(
+        "world_boss.app.cache.generations", LocalCache(16, timedelta(seconds=1))
+    )
+    query = f'mutation {{ invalidateRaidCache(seasonId: 1, password: "{config.graphql_password}") }}'
+    req = fx_test_client.post("/graphql", json={"query": query})
+    assert req.status_code == 200
+    assert req.json()["data"]["invalidateRaidCache"] == 1
+    assert redisdb.get("raid_1_generation") == b"1"
+
+    query = 'mutation { invalidateRaidCache(seasonId: 1, password: "invalid") }'
+    req = fx_test_client.post("/graphql", json={"query": query})
+    assert req.json()["data"] is None
+    assert redisdb.get("raid_1_generation") == b"1"
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from gql import Client, gql
+from prometheus_client import REGISTRY
+from pytest_httpx import HTTPXMock
+
+from world_boss.app.config import config
+from world_boss.app.http_client import (
+    DATA_PROVIDER,
+    HEADLESS,
+    PooledHTTPXAsyncTransport,
+    PooledHTTPXTransport,
+    get_async_client,
+    get_client,
+    run_async,
+)
+
+
+def test_get_client(httpx_mock: HTTPXMock):
+    httpx_mock.add_response(method="GET", url=config.data_provider_url)
+    client = get_client(DATA_PROVIDER)
+    assert get_client(DATA_PROVIDER) is client
+    assert get_client(HEADLESS) is not client
+    name = "world_boss_http_request_seconds_count"
+    labels = {"upstream": DATA_PROVIDER, "status": "200"}
+    count = REGISTRY.get_sample_value(name, labels) or 0
+    client.get(config.data_provider_url)
+    assert REGISTRY.get_sample_value(name, labels) == count + 1
+
+
+def test_get_async_client():
+    async def get():
+        return get_async_client(DATA_PROVIDER), get_async_client(DATA_PROVIDER)
+
+    first, same = asyncio.run(get())
+    assert first is same
+    # a new event loop gets its own client
+    other, _ = asyncio.run(get())
+    assert other is not first
+
+
+def test_run_async():
+    async def get():
+        return get_async_client(DATA_PROVIDER)
+
+    client = run_async(get())
+    # closed before the event loop ends
+    assert client.is_closed
+
+
+def test_pooled_transport(httpx_mock: HTTPXMock):
+    httpx_mock.add_response(
+        method="POST",
+        url=config.headless_url,
+        match_headers={"Authorization": "Bearer token"},
+        json={"data": {"nodeStatus": {"bootstrapEnded": True}}},
+    )
+    transport = PooledHTTPXTransport(
+        config.headless_url,
+        get_client(HEADLESS),
+        headers={"Authorization": "Bearer token"},
+    )
+    with Client(transport=transport) as session:
+        result = session.execute(gql("query { nodeStatus { bootstrapEnded } }"))
+    assert result == {"nodeStatus": {"bootstrapEnded": True}}
+    assert not get_client(HEADLESS).is_closed
+
+
+@pytest.mark.asyncio
+async def test_pooled_async_transport(httpx_mock: HTTPXMock):
+    httpx_mock.add_response(
+        method="POST",
+        url=config.headless_url,
+        match_headers={"Authorization": "Bearer token"},
+        json={"data": {"nodeStatus": {"bootstrapEnded": True}}},
+    )
+    transport = PooledHTTPXAsyncTransport(
+        config.headless_url,
+        get_async_client(HEADLESS),
+        headers={"Authorization": "Bearer token"},
+    )
+    async with Client(transport=transport) as session:
+        result = await session.execute(gql("query { nodeStatus { bootstrapEnded } }"))
+    assert result == {"nodeStatus": {"bootstrapEnded": True}}
+    assert not get_async_client(HEADLESS).is_closed
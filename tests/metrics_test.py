@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import unittest.mock
+
+from prometheus_client import REGISTRY
+
+from world_boss.app.config import config
+from world_boss.app.metrics import get_registry, push_metrics, render
+
+
+def test_render_multiprocess(tmp_path, monkeypatch):
+    # a worker process writes its values under the shared directory
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from prometheus_client import Counter;"
+            "Counter('world_boss_worker_test_total', 'test.').inc(2)",
+        ],
+        env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)},
+        check=True,
+    )
+    assert get_registry() is REGISTRY
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    assert get_registry() is not REGISTRY
+    assert b"world_boss_worker_test_total 2.0" in render()
+
+
+def test_render_multiprocess_request_latency(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    # a celery worker process observing a data provider request
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from world_boss.app.http_client import DATA_PROVIDER, request_latency;"
+            "request_latency.labels(upstream=DATA_PROVIDER, status='200').observe(0.1)",
+        ],
+        check=True,
+    )
+    assert (
+        b'world_boss_http_request_seconds_count{status="200",upstream="data_provider"} 1.0'
+        in render()
+    )
+
+
+def test_push_metrics(tmp_path, monkeypatch):
+    with unittest.mock.patch("world_boss.app.metrics.push_to_gateway") as m:
+        push_metrics()
+        m.assert_not_called()
+        monkeypatch.setattr(config, "metrics_pushgateway_url", "localhost:9091")
+        push_metrics()
+        args, kwargs = m.call_args
+        assert args == ("localhost:9091",)
+        assert kwargs["job"] == "world_boss_worker"
+        assert kwargs["registry"] is REGISTRY
+        assert kwargs["grouping_key"]["pid"] == str(os.getpid())
+        monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+        push_metrics()
+        # every process of the host is pushed together
+        assert "pid" not in m.call_args.kwargs["grouping_key"]
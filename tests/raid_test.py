@@ -1,31 +1,56 @@
+import json
+import threading
 import typing
-from datetime import date, datetime, timezone
+from datetime import date, datetime, timedelta, timezone
 from typing import List
 from unittest.mock import patch
 
 import bencodex
+import httpx
 import pytest
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import Session
+from starlette.responses import Response
 
-from world_boss.app.cache import cache_exists
+from world_boss.app.cache import LocalCache, add_to_negative_cache, cache_exists
+from world_boss.app.config import config
 from world_boss.app.enums import NetworkType
 from world_boss.app.kms import signer
 from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
+from world_boss.app.orm import ASYNC_SQLALCHEMY_DATABASE_URL
 from world_boss.app.raid import (
+    AGENT_ADDRESS_INDEX_KEY,
+    AGENT_ADDRESS_INDEXED_RAIDS_KEY,
+    RANKED_RAIDS_KEY,
+    backfill_agent_address_index,
+    backfill_raid_rankings,
     bulk_insert_transactions,
     create_unsigned_tx,
+    get_agent_addresses_query,
     get_assets,
     get_claim_items_plain_value,
     get_latest_raid_id,
     get_next_month_last_day,
     get_next_tx_nonce,
     get_prepare_reward_assets_plain_value,
+    get_raid_rewards,
+    get_raid_rewards_async,
     get_reward_count,
     get_transfer_assets_plain_value,
     get_tx_delay_factor,
+    index_agent_addresses,
+    invalidate_raid_cache,
+    invalidate_raid_rewards_cache,
     list_tx_nonce,
+    query_agent_addresses,
+    query_reward_schemas,
+    refresh_raid_rewards_cache,
     row_to_recipient,
     update_agent_address,
+    warm_raid_rewards_cache,
     write_ranking_rewards_csv,
     write_tx_result_csv,
 )
@@ -89,6 +114,87 @@ def test_update_agent_address(
     assert cache_exists(cache_key)
 
 
+def test_update_agent_address_indexed(redisdb, httpx_mock):
+    index_agent_addresses(
+        {
+            "5Ea5755eD86631a4D086CC4Fae41740C8985F1B4": "0xC36f031aA721f52532BA665Ba9F020e45437D98D"
+        }
+    )
+    httpx_mock.add_response(
+        method="POST",
+        url=config.headless_url,
+        json={
+            "data": {
+                "stateQuery": {
+                    "a0": {"agentAddress": "0x9EBD1b4F9DbB851BccEa0CFF32926d81eDf6De52"}
+                }
+            }
+        },
+    )
+    rewards: List[RankingRewardDictionary] = [
+        {
+            "raider": {"address": avatar_address, "ranking": i + 1},
+            "rewards": [],
+        }
+        for i, avatar_address in enumerate(
+            [
+                "5Ea5755eD86631a4D086CC4Fae41740C8985F1B4",
+                "01A0b412721b00bFb5D619378F8ab4E4a97646Ca",
+            ]
+        )
+    ]
+    result = update_agent_address(rewards, 1, NetworkType.MAIN, 0, 2)
+    assert [r["raider"]["agent_address"] for r in result] == [
+        "0xC36f031aA721f52532BA665Ba9F020e45437D98D",
+        "0x9EBD1b4F9DbB851BccEa0CFF32926d81eDf6De52",
+    ]
+    # only the unknown avatar is queried, and indexed afterward
+    (request,) = httpx_mock.get_requests()
+    assert json.loads(request.content)["variables"] == {
+        "a0": "01A0b412721b00bFb5D619378F8ab4E4a97646Ca"
+    }
+    assert redisdb.hgetall(AGENT_ADDRESS_INDEX_KEY) == {
+        b"5Ea5755eD86631a4D086CC4Fae41740C8985F1B4": b"0xC36f031aA721f52532BA665Ba9F020e45437D98D",
+        b"01A0b412721b00bFb5D619378F8ab4E4a97646Ca": b"0x9EBD1b4F9DbB851BccEa0CFF32926d81eDf6De52",
+    }
+    assert redisdb.ttl(AGENT_ADDRESS_INDEX_KEY) == -1
+
+
+def test_query_agent_addresses(httpx_mock, monkeypatch):
+    monkeypatch.setattr(config, "agent_address_chunk_size", 2)
+    monkeypatch.setattr(
+        config, "headless_urls", ["https://a.test/graphql", "https://b.test/graphql"]
+    )
+    avatar_addresses = [f"avatar{i}" for i in range(5)]
+
+    def answer(request):
+        variables = json.loads(request.content)["variables"]
+        return httpx.Response(
+            200,
+            json={
+                "data": {
+                    "stateQuery": {
+                        alias: {"agentAddress": f"agent_of_{avatar_address}"}
+                        for alias, avatar_address in variables.items()
+                    }
+                }
+            },
+        )
+
+    httpx_mock.add_callback(answer)
+    assert query_agent_addresses(avatar_addresses) == {
+        a: f"agent_of_{a}" for a in avatar_addresses
+    }
+    requests = httpx_mock.get_requests()
+    assert sorted(len(json.loads(r.content)["variables"]) for r in requests) == [
+        1,
+        2,
+        2,
+    ]
+    assert {r.url.host for r in requests} == {"a.test", "b.test"}
+    assert get_agent_addresses_query(2) is get_agent_addresses_query(2)
+
+
 @pytest.mark.parametrize("raid_id", [1, 2])
 @pytest.mark.parametrize(
     "start_nonce, bottom, size, last_nonce",
@@ -394,7 +500,7 @@ def test_get_next_month_last_day():
         assert get_next_month_last_day() == datetime(2024, 10, 31, tzinfo=timezone.utc)
 
 
-def test_bulk_insert_transactions(fx_session):
+def test_bulk_insert_transactions(redis_proc, fx_session):
     content = """3,25,0x01069aaf336e6aEE605a8A54D0734b43B62f8Fe4,5b65f5D0e23383FA18d74A62FbEa383c7D11F29d,150000,CRYSTAL,18,175
     3,25,0x01069aaf336e6aEE605a8A54D0734b43B62f8Fe4,5b65f5D0e23383FA18d74A62FbEa383c7D11F29d,560,RUNESTONE_FENRIR1,0,175
     3,25,0x01069aaf336e6aEE605a8A54D0734b43B62f8Fe4,5b65f5D0e23383FA18d74A62FbEa383c7D11F29d,150,RUNESTONE_FENRIR2,0,175
@@ -404,6 +510,11 @@ def test_bulk_insert_transactions(fx_session):
     3,25,5b65f5D0e23383FA18d74A62FbEa383c7D11F29d,0x01069aaf336e6aEE605a8A54D0734b43B62f8Fe4,30,Item_NT_800201,0,175"""
     rows = [r.split(",") for r in content.split("\n")]
     nonce_rows_map = {175: rows}
+    add_to_negative_cache(
+        "raid_rewards_3_not_found",
+        "5b65f5D0e23383FA18d74A62FbEa383c7D11F29d",
+        timedelta(seconds=30),
+    )
     bulk_insert_transactions(
         rows,
         nonce_rows_map,
@@ -413,6 +524,12 @@ def test_bulk_insert_transactions(fx_session):
         "memo",
     )
 
+    assert not cache_exists("raid_rewards_3_not_found")
+    for avatar_address in [
+        "5b65f5D0e23383FA18d74A62FbEa383c7D11F29d",
+        "0x01069aaf336e6aEE605a8A54D0734b43B62f8Fe4",
+    ]:
+        assert cache_exists(f"raid_rewards_{avatar_address}_3_json")
     tx = fx_session.query(Transaction).first()
     assert len(tx.amounts) == 7
     assert tx.tx_result is None
@@ -619,3 +736,216 @@ def test_row_to_recipient(ticker: str):
     assert amount["quantity"] == 150000
     assert amount["decimalPlaces"] == 18
     assert amount["ticker"] == ticker
+
+
+def test_query_reward_schemas(fx_session):
+    reward = WorldBossReward()
+    reward.avatar_address = "avatar_address"
+    reward.agent_address = "agent_address"
+    reward.raid_id = 1
+    reward.ranking = 1
+    for i, (ticker, decimal_places) in enumerate([("CRYSTAL", 18), ("RUNE", 0)]):
+        transaction = Transaction()
+        transaction.tx_id = str(i)
+        transaction.signer = "signer"
+        transaction.payload = "payload"
+        transaction.nonce = i
+        transaction.tx_result = "SUCCESS" if i else None
+        reward_amount = WorldBossRewardAmount()
+        reward_amount.amount = 10
+        reward_amount.ticker = ticker
+        reward_amount.decimal_places = decimal_places
+        reward_amount.reward = reward
+        reward_amount.transaction = transaction
+        fx_session.add(reward_amount)
+    empty_reward = WorldBossReward()
+    empty_reward.avatar_address = "empty_avatar_address"
+    empty_reward.agent_address = "agent_address"
+    empty_reward.raid_id = 1
+    empty_reward.ranking = 2
+    fx_session.add(empty_reward)
+    fx_session.commit()
+
+    statements = []
+    engine = fx_session.get_bind()
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = query_reward_schemas(fx_session, WorldBossReward.raid_id == 1)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    assert len(statements) == 1
+    assert result == [reward.as_schema(), empty_reward.as_schema()]
+
+
+def test_get_raid_rewards_not_found(redis_proc, fx_session):
+    with pytest.raises(HTTPException) as e:
+        get_raid_rewards(1, "avatar_address", fx_session, Response())
+    assert e.value.status_code == 404
+    assert cache_exists("raid_rewards_1_not_found")
+
+    with patch("world_boss.app.raid.query_reward_schemas") as m:
+        with pytest.raises(HTTPException) as e:
+            get_raid_rewards(1, "avatar_address", fx_session, Response())
+        assert e.value.status_code == 404
+        m.assert_not_called()
+
+    invalidate_raid_rewards_cache(1)
+    assert not cache_exists("raid_rewards_1_not_found")
+
+
+def test_get_raid_rewards_early_refresh(redisdb, fx_session, fx_world_boss_rewards):
+    reward = fx_world_boss_rewards[0]
+    response = Response()
+    assert (
+        get_raid_rewards(reward.raid_id, reward.avatar_address, fx_session, response)
+        == reward.as_schema()
+    )
+    cache_key = f"raid_rewards_{reward.avatar_address}_1_json"
+    assert redisdb.exists(f"{cache_key}_delta")
+
+    cached = get_raid_rewards(
+        reward.raid_id, reward.avatar_address, fx_session, Response()
+    )
+    assert cached.headers["X-world-boss-service-response-cached"] == cache_key
+
+    # computing took longer than the remaining ttl
+    redisdb.set(f"{cache_key}_delta", 10**9)
+    refreshed = get_raid_rewards(
+        reward.raid_id, reward.avatar_address, fx_session, Response()
+    )
+    assert refreshed == reward.as_schema()
+
+
+@pytest.mark.asyncio
+async def test_get_raid_rewards_async(redis_proc, fx_world_boss_rewards, monkeypatch):
+    pytest.importorskip("asyncpg")
+    reward = fx_world_boss_rewards[0]
+    threads = []
+
+    def get_generation(namespace: str) -> int:
+        threads.append(threading.current_thread())
+        return 0
+
+    monkeypatch.setattr("world_boss.app.cache.get_generation", get_generation)
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    try:
+        async with AsyncSession(async_engine) as db:
+            response = Response()
+            result = await get_raid_rewards_async(
+                reward.raid_id, reward.avatar_address, db, response
+            )
+            # redis is only read off the event loop
+            assert threads
+            assert threading.current_thread() not in threads
+            assert result == reward.as_schema()
+            assert "X-world-boss-service-response-cached" not in response.headers
+            with pytest.raises(HTTPException):
+                await get_raid_rewards_async(reward.raid_id, "unknown", db, Response())
+    finally:
+        await async_engine.dispose()
+
+
+def test_invalidate_raid_cache(redisdb, fx_session, fx_world_boss_rewards, monkeypatch):
+    monkeypatch.setattr(
+        "world_boss.app.cache.generations", LocalCache(16, timedelta(seconds=1))
+    )
+    reward = fx_world_boss_rewards[0]
+    get_raid_rewards(1, reward.avatar_address, fx_session, Response())
+    cache_key = f"raid_rewards_{reward.avatar_address}_1_json"
+    assert redisdb.exists(cache_key)
+    other_key = f"raid_rewards_{reward.avatar_address}_2_json"
+    redisdb.set(other_key, "{}")
+
+    assert invalidate_raid_cache(1) == 1
+    response = Response()
+    assert (
+        get_raid_rewards(1, reward.avatar_address, fx_session, response)
+        == reward.as_schema()
+    )
+    assert "X-world-boss-service-response-cached" not in response.headers
+    assert redisdb.exists(f"{cache_key}_g1")
+    # other seasons are left alone
+    assert redisdb.exists(other_key)
+
+
+def test_warm_raid_rewards_cache(redisdb, fx_session, fx_world_boss_rewards):
+    reward, other_reward = fx_world_boss_rewards
+    add_to_negative_cache(
+        "raid_rewards_1_not_found", reward.avatar_address, timedelta(seconds=30)
+    )
+    warm_raid_rewards_cache(1, [reward.avatar_address], fx_session)
+    assert not redisdb.exists("raid_rewards_1_not_found")
+    assert json.loads(
+        redisdb.get(f"raid_rewards_{reward.avatar_address}_1_json")
+    ) == jsonable_encoder(reward.as_schema())
+    assert not redisdb.exists(f"raid_rewards_{other_reward.avatar_address}_1_json")
+    assert redisdb.hgetall(AGENT_ADDRESS_INDEX_KEY) == {
+        reward.avatar_address.encode(): reward.agent_address.encode()
+    }
+
+
+def test_backfill_agent_address_index(redisdb, fx_session, fx_world_boss_rewards):
+    reward, _ = fx_world_boss_rewards
+    # partly filled by the headless lookups of a running season
+    index_agent_addresses({reward.avatar_address: reward.agent_address})
+    assert backfill_agent_address_index(fx_session) == len(fx_world_boss_rewards)
+    assert redisdb.hgetall(AGENT_ADDRESS_INDEX_KEY) == {
+        r.avatar_address.encode(): r.agent_address.encode()
+        for r in fx_world_boss_rewards
+    }
+    assert redisdb.hgetall(AGENT_ADDRESS_INDEXED_RAIDS_KEY) == {b"1": b"1"}
+    # indexed seasons are skipped
+    assert backfill_agent_address_index(fx_session) == 0
+
+
+def test_warm_raid_rewards_cache_backfills_rankings(
+    redisdb, fx_session, fx_world_boss_rewards
+):
+    reward, other_reward = fx_world_boss_rewards
+    warm_raid_rewards_cache(1, [reward.avatar_address], fx_session)
+    # the whole season is ranked, not only the warmed avatar
+    assert redisdb.zrange("raid_rankings_1", 0, -1, withscores=True) == [
+        (reward.avatar_address.encode(), reward.ranking),
+        (other_reward.avatar_address.encode(), other_reward.ranking),
+    ]
+
+
+def test_warm_raid_rewards_cache_best_ranking(
+    redisdb, fx_session, fx_world_boss_rewards
+):
+    reward, other_reward = fx_world_boss_rewards
+    warm_raid_rewards_cache(1, [reward.avatar_address], fx_session)
+    # a later reward of the avatar with a better ranking
+    best_reward = WorldBossReward()
+    best_reward.raid_id = 1
+    best_reward.ranking = 1
+    best_reward.avatar_address = other_reward.avatar_address
+    best_reward.agent_address = other_reward.agent_address
+    fx_session.add(best_reward)
+    fx_session.commit()
+    warm_raid_rewards_cache(1, [other_reward.avatar_address], fx_session)
+    # the same score as backfill_raid_rankings gives
+    assert redisdb.zscore("raid_rankings_1", other_reward.avatar_address) == 1
+    redisdb.delete("raid_rankings_1", RANKED_RAIDS_KEY)
+    assert backfill_raid_rankings(1, fx_session) == 2
+    assert redisdb.zscore("raid_rankings_1", other_reward.avatar_address) == 1
+
+
+def test_refresh_raid_rewards_cache(redisdb, fx_session, fx_world_boss_rewards):
+    reward, other_reward = fx_world_boss_rewards
+    warm_raid_rewards_cache(1, [reward.avatar_address], fx_session)
+    transaction = reward.amounts[0].transaction
+    transaction.tx_result = "SUCCESS"
+    fx_session.commit()
+
+    refresh_raid_rewards_cache([transaction.tx_id], fx_session)
+    for r in fx_world_boss_rewards:
+        cached_value = json.loads(
+            redisdb.get(f"raid_rewards_{r.avatar_address}_1_json")
+        )
+        assert cached_value == jsonable_encoder(r.as_schema())
+        assert cached_value["rewards"][0]["tx_result"] == "SUCCESS"
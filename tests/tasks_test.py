@@ -1,15 +1,19 @@
+import csv
 import json
 import time
 import unittest.mock
 from typing import List
 
+import httpx
 import pytest
 from pytest_httpx import HTTPXMock
 
 from world_boss.app.config import config
+from world_boss.app.data_provider import data_provider_client
 from world_boss.app.enums import NetworkType
 from world_boss.app.kms import signer
 from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
+from world_boss.app.raid import index_agent_addresses
 from world_boss.app.stubs import (
     RankingRewardDictionary,
     RankingRewardWithAgentDictionary,
@@ -102,7 +106,7 @@ def test_get_ranking_rewards(
         json={
             "data": {
                 "stateQuery": {
-                    "arg01A0b412721b00bFb5D619378F8ab4E4a97646Ca": {
+                    "a0": {
                         "agentAddress": "0x9EBD1b4F9DbB851BccEa0CFF32926d81eDf6De52",
                     },
                 }
@@ -111,7 +115,7 @@ def test_get_ranking_rewards(
     )
 
     with unittest.mock.patch("world_boss.app.tasks.client.files_upload_v2") as m:
-        get_ranking_rewards.delay("channel_id", raid_id, size + 1, 1, size).get(
+        get_ranking_rewards.delay("channel_id", raid_id, size + 1, 1, size, size).get(
             timeout=10
         )
         m.assert_called_once()
@@ -123,12 +127,113 @@ def test_get_ranking_rewards(
         assert (
             kwargs["filename"] == f"world_boss_{raid_id}_{size + 1}_1_{size}_result.csv"
         )
+        assert kwargs["initial_comment"] == (
+            f"page size: {size}, "
+            f"next page size: {data_provider_client.page_size.size}, "
+            "dropped duplicates: 0"
+        )
     assert redisdb.exists(rewards_cache_key)
     assert redisdb.exists(addresses_cache_key)
     assert redisdb.exists(f"world_boss_{raid_id}_{network_type}_{size}_1")
     assert redisdb.exists(f"world_boss_agents_{raid_id}_{network_type}_{size}_1")
 
 
+@pytest.mark.parametrize(
+    "first_page, duplicates",
+    [
+        # short page
+        ([3, 4], 0),
+        # overlaps the first page
+        ([2, 3, 4], 1),
+    ],
+)
+def test_get_ranking_rewards_refetch(
+    redisdb,
+    celery_session_worker,
+    httpx_mock: HTTPXMock,
+    fx_ranking_rewards,
+    first_page: List[int],
+    duplicates: int,
+):
+    raid_id = 21
+    avatar_addresses = [f"{i:040x}" for i in range(6)]
+    index_agent_addresses({a: a for a in avatar_addresses})
+    requests: List[tuple[int, int]] = []
+
+    def data_provider(request: httpx.Request) -> httpx.Response:
+        variables = json.loads(request.read())["variables"]
+        offset, limit = variables["offset"], variables["limit"]
+        rankings = list(range(offset, offset + limit))
+        # every time, not to recover by requesting the same page again
+        if (offset, limit) == (3, 3):
+            rankings = first_page
+        requests.append((offset, limit))
+        rewards = [
+            {
+                "raider": {"address": avatar_addresses[i], "ranking": i + 1},
+                "rewards": fx_ranking_rewards,
+            }
+            for i in rankings
+        ]
+        return httpx.Response(200, json={"data": {"worldBossRankingRewards": rewards}})
+
+    httpx_mock.add_callback(data_provider, method="POST", url=config.data_provider_url)
+    rows: List[List[str]] = []
+
+    def upload(**kwargs):
+        with open(kwargs["file"]) as f:
+            rows.extend(csv.reader(f))
+
+    with unittest.mock.patch(
+        "world_boss.app.tasks.client.files_upload_v2", side_effect=upload
+    ) as m:
+        get_ranking_rewards.delay("channel_id", raid_id, 6, 1, 6, 3).get(timeout=10)
+    assert m.call_args.kwargs["initial_comment"].endswith(
+        f"dropped duplicates: {duplicates}"
+    )
+    # only the missing part of the page is requested, after the collected ones
+    assert sorted(requests) == [(0, 3), (3, 3), (5, 1)]
+    # rows of each raider, in ranking order
+    assert list(dict.fromkeys((row[1], row[3]) for row in rows[1:])) == [
+        (str(i + 1), a) for i, a in enumerate(avatar_addresses)
+    ]
+
+
+def test_get_ranking_rewards_refetch_error(
+    redisdb,
+    celery_session_worker,
+    httpx_mock: HTTPXMock,
+    fx_ranking_rewards,
+):
+    raid_id = 22
+    avatar_address = "5Ea5755eD86631a4D086CC4Fae41740C8985F1B4"
+    index_agent_addresses({avatar_address: avatar_address})
+    rewards = [
+        {
+            "raider": {"address": avatar_address, "ranking": 1},
+            "rewards": fx_ranking_rewards,
+        }
+    ]
+    # every page returns the same raider
+    httpx_mock.add_callback(
+        lambda request: httpx.Response(
+            200, json={"data": {"worldBossRankingRewards": rewards}}
+        ),
+        method="POST",
+        url=config.data_provider_url,
+    )
+
+    with unittest.mock.patch(
+        "world_boss.app.tasks.client.chat_postMessage"
+    ) as m, pytest.raises(Exception):
+        get_ranking_rewards.delay("channel_id", raid_id, 2, 1, 2, 1).get(timeout=10)
+    m.assert_called_once_with(
+        channel="channel_id",
+        text=f"failed to get rewards from {config.data_provider_url} exc: "
+        f"no new rewards between 1 and 2 of season {raid_id}",
+    )
+
+
 def test_get_ranking_rewards_error(
     redisdb,
     celery_session_worker,
@@ -370,6 +475,36 @@ def test_stage_transactions_with_countdown(
         )
 
 
+def test_save_ranking_rewards_synced(
+    redisdb,
+    httpx_mock: HTTPXMock,
+    fx_session,
+    fx_world_boss_rewards,
+):
+    raid_id = 1
+    index_agent_addresses(
+        {r.avatar_address: r.agent_address for r in fx_world_boss_rewards}
+    )
+    httpx_mock.add_response(
+        method="POST",
+        url=config.data_provider_url,
+        json={
+            "data": {
+                "worldBossRankingRewards": [
+                    {
+                        "raider": {"address": r.avatar_address, "ranking": r.ranking},
+                        "rewards": [],
+                    }
+                    for r in fx_world_boss_rewards
+                ]
+            }
+        },
+    )
+    tx_count = fx_session.query(Transaction).count()
+    save_ranking_rewards(raid_id, 500, 50, len(fx_world_boss_rewards))
+    assert fx_session.query(Transaction).count() == tx_count
+
+
 def test_save_ranking_rewards(
     redisdb,
     celery_session_worker,
@@ -380,7 +515,7 @@ def test_save_ranking_rewards(
     raid_id = 1
     network_type = NetworkType.MAIN
     rewards: dict[str, RankingRewardDictionary] = {}
-    graphql_result: dict = {}
+    agent_addresses: dict[str, str] = {}
     # raid_id,ranking,agent_address,avatar_address,amount,ticker,decimal_places,target_nonce
     for line in fx_ranking_reward_csv.split("\n"):
         row = line.split(",")
@@ -393,7 +528,7 @@ def test_save_ranking_rewards(
                 },
                 "rewards": [],
             }
-            graphql_result[f"arg{avatar_address}"] = {"agentAddress": row[2]}
+            agent_addresses[avatar_address] = row[2]
         rewards[avatar_address]["rewards"].append(
             {
                 "currency": {
@@ -412,12 +547,20 @@ def test_save_ranking_rewards(
         url=config.data_provider_url,
         json={"data": {"worldBossRankingRewards": requested_rewards}},
     )
-    httpx_mock.add_response(
-        method="POST",
-        url=config.headless_url,
-        json={"data": {"stateQuery": graphql_result}},
-    )
+
+    # avatars are queried in chunks, aliased a0..a{n} in each
+    def headless(request: httpx.Request) -> httpx.Response:
+        variables = json.loads(request.read())["variables"]
+        state_query = {
+            alias: {"agentAddress": agent_addresses[avatar_address]}
+            for alias, avatar_address in variables.items()
+        }
+        return httpx.Response(200, json={"data": {"stateQuery": state_query}})
+
+    httpx_mock.add_callback(headless, method="POST", url=config.headless_url)
     save_ranking_rewards(raid_id, 500, 50, len(rewards))
+    # 125 avatars in chunks of agent_address_chunk_size
+    assert len(httpx_mock.get_requests(url=config.headless_url)) == 2
     assert redisdb.exists(f"world_boss_{raid_id}_{network_type}_0_500")
     assert redisdb.exists(f"world_boss_agents_{raid_id}_{network_type}_0_500")
     query = fx_session.query(Transaction)
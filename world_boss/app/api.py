@@ -1,27 +1,34 @@
 import csv
 from io import StringIO
-from typing import Annotated, cast
+from typing import Annotated, List, Optional, Union, cast
 
-import httpx
 from celery import chord
-from fastapi import APIRouter, Depends, Form, Request
+from fastapi import APIRouter, Body, Depends, Form, Header, Query, Request
 from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse, Response
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
 from world_boss.app.config import config
 from world_boss.app.enums import NetworkType
+from world_boss.app.http_client import SLACK, get_client
 from world_boss.app.kms import signer
+from world_boss.app.metrics import CONTENT_TYPE_LATEST, render
 from world_boss.app.models import Transaction
-from world_boss.app.orm import SessionLocal
+from world_boss.app.orm import AsyncSessionLocal, SessionLocal
 from world_boss.app.raid import (
+    get_agent_rewards,
     get_currencies,
     get_next_tx_nonce,
+    get_raid_rankings,
     get_raid_rewards,
+    get_raid_rewards_async,
+    get_raid_rewards_batch,
+    iter_raid_rewards_ndjson,
     list_tx_nonce,
     row_to_recipient,
 )
-from world_boss.app.schemas import WorldBossRewardSchema
+from world_boss.app.schemas import RaidRankingSchema, WorldBossRewardSchema
 from world_boss.app.slack import client, slack_auth
 from world_boss.app.stubs import Recipient
 from world_boss.app.tasks import (
@@ -49,7 +56,11 @@ def get_db():
         db.close()
 
 
-@api.get("/ping")
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def pong(db: Session = Depends(get_db)) -> JSONResponse:
     try:
         db.execute(text("select 1"))
@@ -61,14 +72,95 @@ def pong(db: Session = Depends(get_db)) -> JSONResponse:
     return JSONResponse(message, status_code)
 
 
-@api.get("/raid/{raid_id}/{avatar_address}/rewards")
+async def pong_async(db: AsyncSession = Depends(get_async_db)) -> JSONResponse:
+    try:
+        await db.execute(text("select 1"))
+        status_code = 200
+        message = "pong"
+    except Exception as e:
+        status_code = 503
+        message = "database connection failed"
+    return JSONResponse(message, status_code)
+
+
 def raid_rewards(
     response: Response,
     raid_id: int,
     avatar_address: str,
     db: Session = Depends(get_db),
-) -> WorldBossRewardSchema:
-    return get_raid_rewards(raid_id, avatar_address, db, response)
+    if_none_match: Optional[str] = Header(None),
+) -> Union[WorldBossRewardSchema, Response]:
+    return get_raid_rewards(raid_id, avatar_address, db, response, if_none_match)
+
+
+async def raid_rewards_async(
+    response: Response,
+    raid_id: int,
+    avatar_address: str,
+    db: AsyncSession = Depends(get_async_db),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[WorldBossRewardSchema, Response]:
+    return await get_raid_rewards_async(
+        raid_id, avatar_address, db, response, if_none_match
+    )
+
+
+# public read endpoints run on the event loop when the async engine is enabled.
+api.add_api_route(
+    "/ping", pong_async if config.async_database else pong, methods=["GET"]
+)
+api.add_api_route(
+    "/raid/{raid_id}/{avatar_address}/rewards",
+    raid_rewards_async if config.async_database else raid_rewards,
+    methods=["GET"],
+    response_model=WorldBossRewardSchema,
+)
+
+
+@api.post("/raid/{raid_id}/rewards:batch")
+def raid_rewards_batch(
+    raid_id: int,
+    avatar_addresses: List[str] = Body(),
+    db: Session = Depends(get_db),
+) -> List[WorldBossRewardSchema]:
+    return get_raid_rewards_batch(raid_id, avatar_addresses, db)
+
+
+@api.get("/agent/{agent_address}/rewards", response_model=List[WorldBossRewardSchema])
+def agent_rewards(
+    agent_address: str,
+    raid_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+) -> Union[List[WorldBossRewardSchema], Response]:
+    return get_agent_rewards(agent_address, raid_id, db)
+
+
+@api.get("/raid/{raid_id}/rankings")
+def raid_rankings(
+    raid_id: int,
+    start: int = Query(1, ge=1),
+    stop: int = Query(100, ge=1),
+    db: Session = Depends(get_db),
+) -> List[RaidRankingSchema]:
+    return get_raid_rankings(raid_id, start, stop, db)
+
+
+@api.get("/raid/{raid_id}/rewards/export")
+def raid_rewards_export(
+    raid_id: int,
+    after_ranking: Optional[int] = None,
+    after_avatar_address: Optional[str] = None,
+    db: Session = Depends(get_db),
+) -> StreamingResponse:
+    return StreamingResponse(
+        iter_raid_rewards_ndjson(raid_id, db, after_ranking, after_avatar_address),
+        media_type="application/x-ndjson",
+    )
+
+
+@api.get("/metrics")
+def metrics() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
 
 
 @api.post("/raid/list/count")
@@ -104,9 +196,11 @@ async def prepare_transfer_assets(
     res = client.files_info(file=file_id)
     data = cast(dict, res.data)
     file = data["file"]
-    content = httpx.get(
-        file["url_private"], headers={"Authorization": "Bearer %s" % client.token}
-    ).content.decode()
+    content = (
+        get_client(SLACK)
+        .get(file["url_private"], headers={"Authorization": "Bearer %s" % client.token})
+        .content.decode()
+    )
     stream = StringIO(content)
     has_header = csv.Sniffer().has_header(content)
     reader = csv.reader(stream)
@@ -1,31 +1,635 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
 from datetime import timedelta
-from typing import Union, cast
+from typing import (
+    Awaitable,
+    Callable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
+from prometheus_client import Counter, Gauge, Histogram
 from redis import StrictRedis
+from redis.client import PubSub, PubSubWorkerThread
 
 __all__ = [
+    "add_to_negative_cache",
+    "add_to_sorted_set",
+    "bump_generation",
     "cache_exists",
+    "compression_stats",
+    "CompressionStats",
+    "delete_from_cache",
     "get_from_cache",
+    "get_from_hash",
+    "get_many",
+    "get_generation",
+    "get_key_family",
+    "get_many_early_refresh",
+    "get_raid_cache_namespace",
+    "LocalCache",
+    "local_cache",
+    "namespaced_key",
+    "negative_cache_exists",
+    "range_sorted_set_by_score",
+    "set_many",
     "set_to_cache",
+    "set_to_hash",
+    "single_flight",
+    "single_flight_async",
 ]
 
 from world_boss.app.config import config
+from world_boss.app.metrics import LATENCY_BUCKETS
 
 rd = StrictRedis(host=config.redis_host, port=config.redis_port, db=0)
 
+T = TypeVar("T")
+TTL = Union[timedelta, None]
+
+DEFAULT_TTL = timedelta(minutes=60)
+# > 1 favors earlier refreshes, < 1 later ones
+EARLY_REFRESH_BETA = 1.0
+LEASE_TTL = timedelta(seconds=5)
+LOCAL_CACHE_INVALIDATION_CHANNEL = "world_boss_local_cache_invalidation"
+WORKER_ID = uuid.uuid4().hex
+# how long a worker keeps using a namespace generation it read
+GENERATION_CACHE_TTL = timedelta(seconds=1)
+# prefix of zlib compressed values. json values never start with it, so entries
+# written before compression was added are still read as they are.
+COMPRESSED_HEADER = b"\x00"
+LEASE_POLL_INTERVAL = 0.05
+# delete the lease only if it is still held by the given token
+release_lease_script = rd.register_script(
+    """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+)
+
+
+cache_hits = Counter(
+    "world_boss_cache_hits_total",
+    "cache lookups that found a value.",
+    ["family", "tier"],
+)
+cache_misses = Counter(
+    "world_boss_cache_misses_total", "cache lookups that found nothing.", ["family"]
+)
+cache_sets = Counter("world_boss_cache_sets_total", "values written.", ["family"])
+cache_evictions = Counter(
+    "world_boss_cache_evictions_total",
+    "entries evicted from the local tier by its size limit.",
+    ["family"],
+)
+cache_latency = Histogram(
+    "world_boss_cache_operation_seconds",
+    "latency of redis cache operations.",
+    ["family", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+cache_compression_ratio = Gauge(
+    "world_boss_cache_compression_ratio",
+    "raw / stored size of cached values written by this process.",
+    multiprocess_mode="liveall",
+)
+
+
+def get_key_family(key: str) -> str:
+    """
+    coarse kind of a cache key, used as metric label.
+    """
+    if key.startswith(("raid_rewards_", "agent_rewards_")):
+        return "reward"
+    if key.startswith("world_boss_agents_"):
+        return "agent_lookup"
+    if key.startswith("agent_address_index"):
+        return "agent_index"
+    if key.startswith("world_boss_"):
+        return "ranking_page"
+    if key.startswith("raid_rankings_"):
+        return "leaderboard"
+    if key.endswith("_uploaded"):
+        return "upload_marker"
+    if key.endswith("_generation"):
+        return "generation"
+    return "other"
+
+
+def _record_lookup(
+    keys: List[str], values: List[Union[str, bytes, None]], tier: str = "redis"
+):
+    for key, value in zip(keys, values):
+        if value is None:
+            cache_misses.labels(family=get_key_family(key)).inc()
+        else:
+            cache_hits.labels(family=get_key_family(key), tier=tier).inc()
+
+
+class LocalCache:
+    """
+    bounded in-process lru cache in front of redis.
+    entries live for ttl at most, and are dropped when another worker publishes
+    an invalidation of their key.
+    """
+
+    def __init__(self, maxsize: int, ttl: timedelta):
+        self.maxsize = maxsize
+        self.ttl = ttl.total_seconds()
+        self._entries: OrderedDict[str, Tuple[float, Union[str, bytes]]] = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation, so values read from redis before an
+        # invalidation are not stored after it.
+        self.generation = 0
+
+    def get(self, key: str) -> Union[str, bytes, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expire_at, value = entry
+            if expire_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Union[str, bytes], generation: int):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                cache_evictions.labels(family=get_key_family(evicted)).inc()
+
+    def delete(self, *keys: str):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CompressionStats:
+    """
+    bytes written to redis before and after compression.
+    """
+
+    def __init__(self):
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, raw_bytes: int, stored_bytes: int):
+        with self._lock:
+            self.raw_bytes += raw_bytes
+            self.stored_bytes += stored_bytes
+        cache_compression_ratio.set(self.ratio)
+
+    @property
+    def ratio(self) -> float:
+        """
+        raw / stored size of every value written so far.
+        """
+        if not self.stored_bytes:
+            return 1.0
+        return self.raw_bytes / self.stored_bytes
+
+
+compression_stats = CompressionStats()
+
+
+def encode_value(value):
+    """
+    compress value with zlib if it is at least config.cache_compression_threshold
+    bytes long and compression actually saves space.
+    """
+    if not isinstance(value, (str, bytes)):
+        return value
+    raw = value.encode() if isinstance(value, str) else value
+    stored = raw
+    if len(raw) >= config.cache_compression_threshold:
+        compressed = COMPRESSED_HEADER + zlib.compress(raw)
+        if len(compressed) < len(raw):
+            stored = compressed
+    compression_stats.record(len(raw), len(stored))
+    return stored
+
+
+def decode_value(value: Union[str, bytes, None]) -> Union[str, bytes, None]:
+    if isinstance(value, bytes) and value.startswith(COMPRESSED_HEADER):
+        return zlib.decompress(value[len(COMPRESSED_HEADER) :])
+    return value
+
+
+local_cache: Optional[LocalCache] = None
+if config.local_cache_size > 0:
+    local_cache = LocalCache(
+        config.local_cache_size, timedelta(seconds=config.local_cache_ttl)
+    )
+_subscriber: Optional[PubSubWorkerThread] = None
+_subscriber_lock = threading.Lock()
+
+
+def _handle_invalidation(message: dict):
+    data = json.loads(message["data"])
+    if local_cache is not None and data["worker"] != WORKER_ID:
+        local_cache.delete(*data["keys"])
+
+
+def _get_local_cache() -> Optional[LocalCache]:
+    """
+    return the local cache tier if enabled, subscribing to invalidations of
+    other workers on first use.
+    """
+    global _subscriber
+    if local_cache is None:
+        return None
+    if _subscriber is None or not _subscriber.is_alive():
+        with _subscriber_lock:
+            if _subscriber is None or not _subscriber.is_alive():
+                # entries may have missed invalidations while unsubscribed
+                local_cache.clear()
+                pubsub: PubSub = rd.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(
+                    **{LOCAL_CACHE_INVALIDATION_CHANNEL: _handle_invalidation}
+                )
+                _subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True)
+    return local_cache
+
+
+def _publish_invalidation(pipe, keys: List[str]) -> Optional[LocalCache]:
+    """
+    queue an invalidation of keys for other workers on pipe.
+    the caller drops keys from the returned local tier once pipe is executed.
+    """
+    cache = _get_local_cache()
+    if cache is not None and keys:
+        pipe.publish(
+            LOCAL_CACHE_INVALIDATION_CHANNEL,
+            json.dumps({"worker": WORKER_ID, "keys": keys}),
+        )
+    return cache
+
+
+generations = LocalCache(1024, GENERATION_CACHE_TTL)
+
+
+def get_generation_cache_key(namespace: str) -> str:
+    return f"{namespace}_generation"
+
+
+def get_generation(namespace: str) -> int:
+    """
+    current generation of namespace. kept in process for GENERATION_CACHE_TTL,
+    so building many keys of a namespace costs one GET at most.
+    """
+    cache_key = get_generation_cache_key(namespace)
+    value = generations.get(cache_key)
+    if value is None:
+        generation = generations.generation
+        value = rd.get(cache_key) or b"0"
+        generations.set(cache_key, value, generation)
+    return int(value)
+
+
+def bump_generation(namespace: str) -> int:
+    """
+    invalidate every key of namespace at once. keys of older generations are
+    no longer read and expire with their ttl.
+    :return: new generation of namespace.
+    """
+    cache_key = get_generation_cache_key(namespace)
+    generation = rd.incr(cache_key)
+    generations.delete(cache_key)
+    return cast(int, generation)
+
+
+def namespaced_key(namespace: str, key: str) -> str:
+    """
+    key in the current generation of namespace.
+    generation 0 keeps key as is, so entries cached before a namespace is
+    first bumped stay readable.
+    """
+    generation = get_generation(namespace)
+    if generation == 0:
+        return key
+    return f"{key}_g{generation}"
+
+
+def get_raid_cache_namespace(raid_id: int) -> str:
+    """
+    namespace of every entry cached for the season.
+    """
+    return f"raid_{raid_id}"
+
 
 def cache_exists(key: str):
-    return rd.exists(key)
+    with cache_latency.labels(family=get_key_family(key), operation="exists").time():
+        exists = rd.exists(key)
+    _record_lookup([key], [b"1" if exists else None])
+    return exists
+
+
+def set_to_cache(key: str, pickled_object, ttl: TTL = DEFAULT_TTL):
+    set_many({key: pickled_object}, ttl)
+
+
+def get_from_cache(key: str) -> Union[str, bytes, None]:
+    """
+    get value of key in a single round trip, instead of EXISTS then GET.
+    served from the local tier when it holds the key. None if missing.
+    """
+    return get_many([key])[0]
+
+
+def get_many(keys: List[str]) -> List[Union[str, bytes, None]]:
+    """
+    get values of keys with a single MGET. missing keys are returned as None.
+    keys held by the local tier are not requested from redis.
+    """
+    if not keys:
+        return []
+    family = get_key_family(keys[0])
+    cache = _get_local_cache()
+    if cache is None:
+        with cache_latency.labels(family=family, operation="get").time():
+            values = [decode_value(value) for value in rd.mget(keys)]
+        _record_lookup(keys, values)
+        return values
+    values = [cache.get(key) for key in keys]
+    missing = [i for i, value in enumerate(values) if value is None]
+    for key, value in zip(keys, values):
+        if value is not None:
+            cache_hits.labels(family=get_key_family(key), tier="local").inc()
+    if missing:
+        generation = cache.generation
+        missing_keys = [keys[i] for i in missing]
+        with cache_latency.labels(family=family, operation="get").time():
+            fetched = [decode_value(value) for value in rd.mget(missing_keys)]
+        _record_lookup(missing_keys, fetched)
+        for i, value in zip(missing, fetched):
+            if value is not None:
+                values[i] = value
+                cache.set(keys[i], value, generation)
+    return values
+
+
+def get_many_early_refresh(
+    keys: List[str], beta: float = EARLY_REFRESH_BETA
+) -> Tuple[List[Union[str, bytes, None]], bool]:
+    """
+    get values of keys like get_many, in a single round trip.
+    also tells if keys[0] should be rebuilt before it expires, with probability
+    growing as its expiry nears and with the time it took to compute (xfetch).
+    :return: values of keys, and True if the caller should rebuild them now.
+    """
+    cache = _get_local_cache()
+    if cache is not None:
+        values = [cache.get(key) for key in keys]
+        if all(value is not None for value in values):
+            _record_lookup(keys, values, "local")
+            return values, False
+        generation = cache.generation
+    with cache_latency.labels(family=get_key_family(keys[0]), operation="get").time():
+        with rd.pipeline(transaction=False) as pipe:
+            pipe.mget(keys)
+            pipe.get(get_delta_cache_key(keys[0]))
+            pipe.pttl(keys[0])
+            fetched, delta, pttl = pipe.execute()
+    values = [decode_value(value) for value in fetched]
+    _record_lookup(keys, values)
+    if cache is not None:
+        for key, value in zip(keys, values):
+            if value is not None:
+                cache.set(key, value, generation)
+    refresh = (
+        values[0] is not None
+        and delta is not None
+        and pttl > 0
+        and float(delta) * beta * -math.log(1.0 - random.random()) >= pttl / 1000
+    )
+    return values, refresh
+
 
+def get_delta_cache_key(key: str) -> str:
+    return f"{key}_delta"
 
-def set_to_cache(
-    key: str, pickled_object, ttl: Union[timedelta, None] = timedelta(minutes=60)
+
+def set_many(
+    mapping: Mapping[str, Union[str, bytes]],
+    ttl: Union[TTL, Mapping[str, TTL]] = DEFAULT_TTL,
+    deltas: Optional[Mapping[str, float]] = None,
 ):
-    if ttl is None:
-        rd.set(key, pickled_object)
-    else:
-        rd.setex(key, ttl, pickled_object)
+    """
+    set values of mapping through a single pipeline. large values are stored
+    compressed, see encode_value.
+    :param mapping: key : value to set.
+    :param ttl: ttl of every key, or key : ttl. keys missing in the latter use
+        the default ttl.
+    :param deltas: key : seconds it took to compute the value. stored next to
+        the value for :func:`get_many_early_refresh`.
+    """
+    if not mapping:
+        return
+    deltas = deltas or {}
+    with rd.pipeline(transaction=False) as pipe:
+        for key, value in mapping.items():
+            value = encode_value(value)
+            key_ttl = ttl.get(key, DEFAULT_TTL) if isinstance(ttl, Mapping) else ttl
+            if key_ttl is None:
+                pipe.set(key, value)
+            else:
+                pipe.setex(key, key_ttl, value)
+            if key in deltas:
+                delta_key = get_delta_cache_key(key)
+                if key_ttl is None:
+                    pipe.set(delta_key, deltas[key])
+                else:
+                    pipe.setex(delta_key, key_ttl, deltas[key])
+        cache = _publish_invalidation(pipe, list(mapping))
+        with cache_latency.labels(
+            family=get_key_family(next(iter(mapping))), operation="set"
+        ).time():
+            pipe.execute()
+    if cache is not None:
+        cache.delete(*mapping)
+    for key in mapping:
+        cache_sets.labels(family=get_key_family(key)).inc()
+
+
+def delete_from_cache(*keys: str):
+    if keys:
+        with rd.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            cache = _publish_invalidation(pipe, list(keys))
+            with cache_latency.labels(
+                family=get_key_family(keys[0]), operation="delete"
+            ).time():
+                pipe.execute()
+        if cache is not None:
+            cache.delete(*keys)
+
+
+def add_to_negative_cache(key: str, member: str, ttl: timedelta):
+    """
+    record member as missing in the sorted set of key until ttl passes.
+    each member expires on its own, and deleting key clears every member at once.
+    """
+    now = time.time()
+    with rd.pipeline(transaction=False) as pipe:
+        pipe.zadd(key, {member: now + ttl.total_seconds()})
+        pipe.zremrangebyscore(key, "-inf", now)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+
+def negative_cache_exists(key: str, member: str) -> bool:
+    with cache_latency.labels(family=get_key_family(key), operation="exists").time():
+        expire_at = rd.zscore(key, member)
+    exists = expire_at is not None and expire_at > time.time()
+    _record_lookup([key], [b"1" if exists else None])
+    return exists
+
+
+def add_to_sorted_set(key: str, mapping: Mapping[str, float]):
+    if mapping:
+        rd.zadd(key, mapping)
+
+
+def get_from_hash(key: str, fields: List[str]) -> List[Optional[bytes]]:
+    """
+    get fields of the hash of key at once. missing fields are None.
+    """
+    if not fields:
+        return []
+    with cache_latency.labels(family=get_key_family(key), operation="get").time():
+        values = cast(List[Optional[bytes]], rd.hmget(key, fields))
+    _record_lookup([key] * len(fields), cast(list, values))
+    return values
+
+
+def set_to_hash(key: str, mapping: Mapping[str, str]):
+    """
+    set fields of the hash of key. the hash never expires.
+    """
+    if mapping:
+        with cache_latency.labels(family=get_key_family(key), operation="set").time():
+            rd.hset(key, mapping=cast(dict, mapping))
+        cache_sets.labels(family=get_key_family(key)).inc(len(mapping))
+
+
+def range_sorted_set_by_score(
+    key: str, min_score: float, max_score: float
+) -> List[Tuple[bytes, float]]:
+    with cache_latency.labels(family=get_key_family(key), operation="range").time():
+        return cast(
+            List[Tuple[bytes, float]],
+            rd.zrangebyscore(key, min_score, max_score, withscores=True),
+        )
+
+
+def single_flight(
+    key: str,
+    build: Callable[[], T],
+    load: Callable[[], Optional[T]],
+    lease_ttl: timedelta = LEASE_TTL,
+    stale: Optional[T] = None,
+) -> T:
+    """
+    coalesce concurrent rebuilds of a missing cache entry.
+    the caller holding the lease of key runs build, which is expected to cache its
+    result under key. the others wait for the entry and return load instead.
+    :param key: cache key to rebuild.
+    :param build: computes and caches the value.
+    :param load: reads the value built by the lease holder, None if not available.
+    :param lease_ttl: upper bound of build time.
+    :param stale: value to return at once instead of waiting, when another
+        caller is already refreshing it.
+    """
+    lease_key = f"{key}_lease"
+    token = uuid.uuid4().hex
+    if rd.set(lease_key, token, nx=True, px=lease_ttl):
+        try:
+            return build()
+        finally:
+            release_lease_script(keys=[lease_key], args=[token])
+    if stale is not None:
+        return stale
+    deadline = time.monotonic() + lease_ttl.total_seconds()
+    while time.monotonic() < deadline:
+        time.sleep(LEASE_POLL_INTERVAL)
+        if not _wait_lease(key, lease_key):
+            break
+    # lease holder finished or timed out
+    loaded = load()
+    if loaded is not None:
+        return loaded
+    return build()
+
+
+async def single_flight_async(
+    key: str,
+    build: Callable[[], Awaitable[T]],
+    load: Callable[[], Optional[T]],
+    lease_ttl: timedelta = LEASE_TTL,
+    stale: Optional[T] = None,
+) -> T:
+    """
+    :func:`single_flight` for coroutines. redis calls and load run in a worker
+    thread, so neither waiting nor the blocking client stalls the event loop.
+    """
+    lease_key = f"{key}_lease"
+    token = uuid.uuid4().hex
+    if await asyncio.to_thread(rd.set, lease_key, token, nx=True, px=lease_ttl):
+        try:
+            return await build()
+        finally:
+            await asyncio.to_thread(
+                release_lease_script, keys=[lease_key], args=[token]
+            )
+    if stale is not None:
+        return stale
+    deadline = time.monotonic() + lease_ttl.total_seconds()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LEASE_POLL_INTERVAL)
+        if not await asyncio.to_thread(_wait_lease, key, lease_key):
+            break
+    loaded = await asyncio.to_thread(load)
+    if loaded is not None:
+        return loaded
+    return await build()
 
 
-def get_from_cache(key: str) -> Union[str, bytes]:
-    return cast(Union[str, bytes], rd.get(key))
+def _wait_lease(key: str, lease_key: str) -> bool:
+    """
+    :return: True while the entry is missing and its lease is still held.
+    """
+    with rd.pipeline(transaction=False) as pipe:
+        pipe.exists(key)
+        pipe.exists(lease_key)
+        exists, leased = pipe.execute()
+    return not exists and bool(leased)
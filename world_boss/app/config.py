@@ -1,6 +1,7 @@
-from typing import TYPE_CHECKING
+import json
+from typing import TYPE_CHECKING, Any, List
 
-from pydantic import BaseSettings
+from pydantic import BaseSettings, validator
 
 if TYPE_CHECKING:
     PostgresDsn = str
@@ -14,6 +15,7 @@ __all__ = "config"
 
 class Settings(BaseSettings):
     database_url: PostgresDsn
+    async_database: bool = False
     default_redis_url: RedisDsn = "redis://localhost:6379"
     kms_key_id: str
     slack_token: str
@@ -33,6 +35,42 @@ class Settings(BaseSettings):
     headless_jwt_algorithm: str
     planet_id: str
     scheduler_interval: int = 60 * 5
+    # in-process cache tier in front of redis. disabled with 0
+    local_cache_size: int = 0
+    local_cache_ttl: int = 5
+    # cached values of at least this many bytes are stored zlib compressed
+    cache_compression_threshold: int = 1024
+    # data provider requests in flight while fetching a season
+    data_provider_concurrency: int = 8
+    # ranking rewards page size adapts between min and max to the target latency
+    data_provider_page_size: int = 500
+    data_provider_min_page_size: int = 50
+    data_provider_max_page_size: int = 2000
+    data_provider_target_latency: float = 2.0
+    # pooled outbound http clients, see world_boss.app.http_client
+    http_timeout: float = 60.0
+    http_connect_timeout: float = 5.0
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http2: bool = False
+    # agent address lookups are split in chunks, queried concurrently and spread
+    # over headless_urls. headless_url is used if empty
+    agent_address_chunk_size: int = 100
+    agent_address_concurrency: int = 4
+    headless_urls: List[str] = []
+    # celery workers push their metrics here when set. see world_boss.app.metrics
+    metrics_pushgateway_url: str = ""
+
+    @validator("headless_urls", pre=True)
+    def split_headless_urls(cls, v):
+        """
+        HEADLESS_URLS is comma separated, or a JSON array.
+        """
+        if isinstance(v, str):
+            if v.lstrip().startswith("["):
+                return json.loads(v)
+            return [url.strip() for url in v.split(",") if url.strip()]
+        return v
 
     class Config:
         env_file = ".env"
@@ -40,6 +78,7 @@ class Settings(BaseSettings):
             "database_url": {
                 "env": "DATABASE_URL",
             },
+            "async_database": {"env": "ASYNC_DATABASE"},
             "kms_key_id": {
                 "env": "KMS_KEY_ID",
             },
@@ -72,7 +111,31 @@ class Settings(BaseSettings):
             "headless_jwt_algorithm": {"env": "HEADLESS_JWT_ALGORITHM"},
             "planet_id": {"env": "PLANET_ID"},
             "scheduler_interval": {"env": "SCHEDULER_INTERVAL"},
+            "local_cache_size": {"env": "LOCAL_CACHE_SIZE"},
+            "local_cache_ttl": {"env": "LOCAL_CACHE_TTL"},
+            "cache_compression_threshold": {"env": "CACHE_COMPRESSION_THRESHOLD"},
+            "data_provider_concurrency": {"env": "DATA_PROVIDER_CONCURRENCY"},
+            "data_provider_page_size": {"env": "DATA_PROVIDER_PAGE_SIZE"},
+            "data_provider_min_page_size": {"env": "DATA_PROVIDER_MIN_PAGE_SIZE"},
+            "data_provider_max_page_size": {"env": "DATA_PROVIDER_MAX_PAGE_SIZE"},
+            "data_provider_target_latency": {"env": "DATA_PROVIDER_TARGET_LATENCY"},
+            "http_timeout": {"env": "HTTP_TIMEOUT"},
+            "http_connect_timeout": {"env": "HTTP_CONNECT_TIMEOUT"},
+            "http_max_connections": {"env": "HTTP_MAX_CONNECTIONS"},
+            "http_max_keepalive_connections": {"env": "HTTP_MAX_KEEPALIVE_CONNECTIONS"},
+            "http2": {"env": "HTTP2"},
+            "agent_address_chunk_size": {"env": "AGENT_ADDRESS_CHUNK_SIZE"},
+            "agent_address_concurrency": {"env": "AGENT_ADDRESS_CONCURRENCY"},
+            "headless_urls": {"env": "HEADLESS_URLS"},
+            "metrics_pushgateway_url": {"env": "METRICS_PUSHGATEWAY_URL"},
         }
 
+        @classmethod
+        def parse_env_var(cls, field_name: str, raw_val: str) -> Any:
+            # left to split_headless_urls, not to fail on comma separated urls
+            if field_name == "headless_urls":
+                return raw_val
+            return json.loads(raw_val)
+
 
 config = Settings()
@@ -1,18 +1,37 @@
+import asyncio
 import json
-from typing import List
+import time
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
 
 import httpx
+from prometheus_client import Counter, Gauge
 
 from world_boss.app.config import config
 from world_boss.app.enums import NetworkType
+from world_boss.app.http_client import DATA_PROVIDER, get_async_client, get_client
 
-__all__ = ["DataProviderClient", "data_provider_client"]
+__all__ = [
+    "AdaptivePageSize",
+    "DataProviderClient",
+    "RankingRewardsCollector",
+    "data_provider_client",
+]
 
-from world_boss.app.cache import cache_exists, get_from_cache, set_to_cache
-from world_boss.app.stubs import RankingRewardDictionary
+from world_boss.app.cache import (
+    get_many_early_refresh,
+    get_raid_cache_namespace,
+    namespaced_key,
+    set_many,
+)
+from world_boss.app.stubs import (
+    RankingRewardDictionary,
+    RankingRewardWithAgentDictionary,
+)
 
 TOTAL_USER_QUERY = "query($raidId: Int!) { worldBossTotalUsers(raidId: $raidId) }"
 DATA_PROVIDER_URL: str = config.data_provider_url
+RANKING_REWARDS_RETRIES = 3
+RANKING_REWARDS_RETRY_INTERVAL = 0.5
 RANKING_REWARDS_QUERY = """
     query($raidId: Int!, $limit: Int!, $offset: Int!) {
         worldBossRankingRewards(raidId: $raidId, limit: $limit, offset: $offset) {
@@ -33,12 +52,94 @@ RANKING_REWARDS_QUERY = """
 """
 
 
+page_size_gauge = Gauge(
+    "world_boss_data_provider_page_size",
+    "ranking rewards page size currently requested from the data provider.",
+    multiprocess_mode="mostrecent",
+)
+
+duplicate_rewards = Counter(
+    "world_boss_data_provider_duplicate_rewards_total",
+    "ranking rewards returned more than once by the data provider.",
+)
+
+
+class RankingRewardsCollector:
+    """
+    ranking rewards collected page by page, in the order they were returned.
+    rows of a raider already collected at the same ranking are dropped, so
+    overlapping pages don't duplicate rewards.
+    """
+
+    def __init__(self):
+        self.rewards: List[RankingRewardWithAgentDictionary] = []
+        self.duplicates = 0
+        self._keys: Set[Tuple[str, int]] = set()
+
+    def __len__(self) -> int:
+        return len(self.rewards)
+
+    def extend(self, rewards: Iterable[RankingRewardWithAgentDictionary]) -> int:
+        """
+        :return: number of dropped duplicates.
+        """
+        duplicates = 0
+        for reward in rewards:
+            key = (reward["raider"]["address"], reward["raider"]["ranking"])
+            if key in self._keys:
+                duplicates += 1
+                continue
+            self._keys.add(key)
+            self.rewards.append(reward)
+        if duplicates:
+            self.duplicates += duplicates
+            duplicate_rewards.inc(duplicates)
+        return duplicates
+
+
+class AdaptivePageSize:
+    """
+    ranking rewards page size that grows while responses stay under the target
+    latency, and halves on slow responses or errors.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency: float):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.size = min(max(initial, minimum), maximum)
+        page_size_gauge.set(self.size)
+
+    def record(self, limit: int, latency: float):
+        """
+        :param limit: page size of the request.
+        :param latency: seconds the request took.
+        """
+        if latency > self.target_latency:
+            self._resize(self.size // 2)
+        elif limit >= self.size:
+            # short last pages tell nothing about larger ones
+            self._resize(self.size + self.size // 2)
+
+    def record_error(self):
+        self._resize(self.size // 2)
+
+    def _resize(self, size: int):
+        self.size = min(max(size, self.minimum), self.maximum)
+        page_size_gauge.set(self.size)
+
+
 class DataProviderClient:
     def __init__(self):
-        self._client = httpx.Client(timeout=None)
+        self.page_size = AdaptivePageSize(
+            config.data_provider_page_size,
+            config.data_provider_min_page_size,
+            config.data_provider_max_page_size,
+            config.data_provider_target_latency,
+        )
 
     def _query(self, query: str, variables: dict):
-        result = self._client.post(
+        result = get_client(DATA_PROVIDER).post(
             DATA_PROVIDER_URL,
             json={"query": query, "variables": variables},
         )
@@ -52,21 +153,170 @@ class DataProviderClient:
     def get_ranking_rewards(
         self, raid_id: int, network_type: NetworkType, offset: int, limit: int
     ) -> List[RankingRewardDictionary]:
-        cache_key = f"world_boss_{raid_id}_{network_type}_{offset}_{limit}"
-        if cache_exists(cache_key):
-            cached_value = get_from_cache(cache_key)
-            rewards = json.loads(cached_value)
-        else:
-            result = self._query(
-                RANKING_REWARDS_QUERY,
-                {"raidId": raid_id, "offset": offset, "limit": limit},
-            )
-            if result.get("errors"):
-                raise RankingRewardsException(result["errors"][0]["message"])
-            rewards = result["data"]["worldBossRankingRewards"]
-            set_to_cache(cache_key, json.dumps(rewards))
+        cache_key = get_ranking_rewards_cache_key(raid_id, network_type, offset, limit)
+        rewards = _get_cached_ranking_rewards(cache_key)
+        if rewards is None:
+            started_at = time.monotonic()
+            try:
+                result = self._query(
+                    RANKING_REWARDS_QUERY,
+                    {"raidId": raid_id, "offset": offset, "limit": limit},
+                )
+                rewards = _cache_ranking_rewards(cache_key, result, started_at)
+            except (RankingRewardsException, httpx.HTTPError):
+                self.page_size.record_error()
+                raise
+            self.page_size.record(limit, time.monotonic() - started_at)
         return rewards
 
+    def iter_ranking_rewards(
+        self,
+        raid_id: int,
+        page_size: Optional[int] = None,
+        network_type: NetworkType = NetworkType.MAIN,
+        offset: int = 0,
+        retries: int = RANKING_REWARDS_RETRIES,
+        total_count: Optional[int] = None,
+    ) -> Iterator[List[RankingRewardDictionary]]:
+        """
+        yield ranking rewards of the season page by page in ranking order.
+        each page is cached like :meth:`get_ranking_rewards`, and only one page is
+        held at a time.
+        :param page_size: raiders per request. adapts to the data provider
+            latency if not given.
+        :param offset: ranking offset to start from.
+        :param retries: times a failed page is retried before its error is raised.
+        :param total_count: raiders of the season. without it, the season ends
+            with an empty page. a short page doesn't end the season, the data
+            provider returns those mid-season as well.
+        """
+        while total_count is None or offset < total_count:
+            page = self._get_ranking_rewards_with_retry(
+                raid_id, network_type, offset, page_size, retries
+            )
+            if not page:
+                return
+            yield page
+            offset += len(page)
+
+    def _get_ranking_rewards_with_retry(
+        self,
+        raid_id: int,
+        network_type: NetworkType,
+        offset: int,
+        page_size: Optional[int],
+        retries: int,
+    ) -> List[RankingRewardDictionary]:
+        attempt = 0
+        while True:
+            # an adaptive page size shrinks after an error, so it is read again
+            limit = page_size or self.page_size.size
+            try:
+                return self.get_ranking_rewards(raid_id, network_type, offset, limit)
+            except (RankingRewardsException, httpx.HTTPError):
+                if attempt >= retries:
+                    raise
+                time.sleep(RANKING_REWARDS_RETRY_INTERVAL * 2**attempt)
+                attempt += 1
+
+    async def _query_async(
+        self, client: httpx.AsyncClient, query: str, variables: dict
+    ):
+        result = await client.post(
+            DATA_PROVIDER_URL,
+            json={"query": query, "variables": variables},
+        )
+        return result.json()
+
+    async def get_ranking_rewards_range_async(
+        self,
+        raid_id: int,
+        network_type: NetworkType,
+        offset: int,
+        total_count: int,
+        limit: int,
+        concurrency: Optional[int] = None,
+    ) -> List[List[RankingRewardDictionary]]:
+        """
+        fetch every page of limit between offset and total_count concurrently.
+        pages are cached with the same keys as :meth:`get_ranking_rewards`.
+        :param concurrency: upper bound of requests in flight. defaults to
+            config.data_provider_concurrency.
+        :return: pages in ranking order. the last page holds the remainder.
+        """
+        semaphore = asyncio.Semaphore(concurrency or config.data_provider_concurrency)
+
+        async def fetch(
+            client: httpx.AsyncClient, page_offset: int
+        ) -> List[RankingRewardDictionary]:
+            page_limit = min(limit, total_count - page_offset)
+            # the redis client is blocking, so it is kept off the event loop
+            cache_key = await asyncio.to_thread(
+                get_ranking_rewards_cache_key,
+                raid_id,
+                network_type,
+                page_offset,
+                page_limit,
+            )
+            rewards = await asyncio.to_thread(_get_cached_ranking_rewards, cache_key)
+            if rewards is not None:
+                return rewards
+            async with semaphore:
+                started_at = time.monotonic()
+                try:
+                    result = await self._query_async(
+                        client,
+                        RANKING_REWARDS_QUERY,
+                        {"raidId": raid_id, "offset": page_offset, "limit": page_limit},
+                    )
+                    rewards = await asyncio.to_thread(
+                        _cache_ranking_rewards, cache_key, result, started_at
+                    )
+                except (RankingRewardsException, httpx.HTTPError):
+                    self.page_size.record_error()
+                    raise
+            self.page_size.record(page_limit, time.monotonic() - started_at)
+            return rewards
+
+        client = get_async_client(DATA_PROVIDER)
+        return await asyncio.gather(
+            *[
+                fetch(client, page_offset)
+                for page_offset in range(offset, total_count, limit)
+            ]
+        )
+
+
+def get_ranking_rewards_cache_key(
+    raid_id: int, network_type: NetworkType, offset: int, limit: int
+) -> str:
+    return namespaced_key(
+        get_raid_cache_namespace(raid_id),
+        f"world_boss_{raid_id}_{network_type}_{offset}_{limit}",
+    )
+
+
+def _get_cached_ranking_rewards(
+    cache_key: str,
+) -> Optional[List[RankingRewardDictionary]]:
+    (cached_value,), refresh = get_many_early_refresh([cache_key])
+    if cached_value is None or refresh:
+        return None
+    return json.loads(cached_value)
+
+
+def _cache_ranking_rewards(
+    cache_key: str, result: dict, started_at: float
+) -> List[RankingRewardDictionary]:
+    if result.get("errors"):
+        raise RankingRewardsException(result["errors"][0]["message"])
+    rewards = result["data"]["worldBossRankingRewards"]
+    set_many(
+        {cache_key: json.dumps(rewards)},
+        deltas={cache_key: time.monotonic() - started_at},
+    )
+    return rewards
+
 
 class RankingRewardsException(Exception):
     pass
@@ -2,7 +2,6 @@ import csv
 import typing
 from io import StringIO
 
-import httpx
 import strawberry
 from celery import chord
 from fastapi import Depends
@@ -13,11 +12,13 @@ from strawberry.types import Info
 from world_boss.app.api import get_db
 from world_boss.app.config import config
 from world_boss.app.data_provider import data_provider_client
+from world_boss.app.http_client import SLACK, get_client
 from world_boss.app.kms import signer
 from world_boss.app.models import Transaction
 from world_boss.app.raid import (
     get_currencies,
     get_next_tx_nonce,
+    invalidate_raid_cache,
     list_tx_nonce,
     row_to_recipient,
 )
@@ -95,9 +96,14 @@ class Mutation:
         res = client.files_info(file=file_id)
         data = typing.cast(dict, res.data)
         file = data["file"]
-        content = httpx.get(
-            file["url_private"], headers={"Authorization": "Bearer %s" % client.token}
-        ).content.decode()
+        content = (
+            get_client(SLACK)
+            .get(
+                file["url_private"],
+                headers={"Authorization": "Bearer %s" % client.token},
+            )
+            .content.decode()
+        )
         stream = StringIO(content)
         has_header = csv.Sniffer().has_header(content)
         reader = csv.reader(stream)
@@ -165,6 +171,10 @@ class Mutation:
         )
         return task.id
 
+    @strawberry.mutation(permission_classes=[IsAuthenticated])
+    def invalidate_raid_cache(self, season_id: int, password: str) -> int:
+        return invalidate_raid_cache(season_id)
+
 
 schema = strawberry.Schema(Query, mutation=Mutation)
 graphql_app = GraphQLRouter(schema, context_getter=get_context)
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+import weakref
+from typing import Any, Coroutine, Dict, Optional, TypeVar
+
+import httpx
+from gql.transport.httpx import HTTPXAsyncTransport, HTTPXTransport
+from graphql import DocumentNode, ExecutionResult
+from prometheus_client import Histogram
+
+from world_boss.app.config import config
+
+__all__ = [
+    "DATA_PROVIDER",
+    "HEADLESS",
+    "SLACK",
+    "PooledHTTPXAsyncTransport",
+    "PooledHTTPXTransport",
+    "aclose_async_clients",
+    "aclose_clients",
+    "get_async_client",
+    "get_client",
+    "run_async",
+]
+
+DATA_PROVIDER = "data_provider"
+HEADLESS = "headless"
+SLACK = "slack"
+
+request_latency = Histogram(
+    "world_boss_http_request_seconds",
+    "latency of outbound http requests.",
+    ["upstream", "status"],
+)
+
+_STARTED_AT = "world_boss_started_at"
+_clients: Dict[str, httpx.Client] = {}
+# event loop : upstream : client. async clients can't be shared across loops,
+# and celery tasks run a new loop with every asyncio.run.
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "timeout": httpx.Timeout(
+            config.http_timeout, connect=config.http_connect_timeout
+        ),
+        "limits": httpx.Limits(
+            max_connections=config.http_max_connections,
+            max_keepalive_connections=config.http_max_keepalive_connections,
+        ),
+        # requires the h2 package
+        "http2": config.http2,
+    }
+
+
+def _observe(upstream: str, response: httpx.Response):
+    started_at = response.request.extensions.get(_STARTED_AT)
+    if started_at is not None:
+        request_latency.labels(
+            upstream=upstream, status=str(response.status_code)
+        ).observe(time.perf_counter() - started_at)
+
+
+def get_client(upstream: str) -> httpx.Client:
+    """
+    pooled client of upstream, shared by every thread of the process.
+    :param upstream: one of DATA_PROVIDER, HEADLESS and SLACK. used as the
+        metric label.
+    """
+    client = _clients.get(upstream)
+    if client is None:
+        with _lock:
+            client = _clients.get(upstream)
+            if client is None:
+
+                def on_request(request: httpx.Request):
+                    request.extensions[_STARTED_AT] = time.perf_counter()
+
+                def on_response(response: httpx.Response):
+                    _observe(upstream, response)
+
+                client = httpx.Client(
+                    event_hooks={"request": [on_request], "response": [on_response]},
+                    **_client_options(),
+                )
+                _clients[upstream] = client
+    return client
+
+
+def get_async_client(upstream: str) -> httpx.AsyncClient:
+    """
+    pooled async client of upstream for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(upstream)
+    if client is None:
+
+        async def on_request(request: httpx.Request):
+            request.extensions[_STARTED_AT] = time.perf_counter()
+
+        async def on_response(response: httpx.Response):
+            _observe(upstream, response)
+
+        client = httpx.AsyncClient(
+            event_hooks={"request": [on_request], "response": [on_response]},
+            **_client_options(),
+        )
+        clients[upstream] = client
+    return client
+
+
+async def aclose_clients():
+    """
+    close pooled clients of the process and of the running event loop.
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+    await aclose_async_clients()
+
+
+async def aclose_async_clients():
+    """
+    close pooled async clients of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    for async_client in _async_clients.pop(loop, {}).values():
+        await async_client.aclose()
+
+
+def run_async(main: Coroutine[Any, Any, T]) -> T:
+    """
+    asyncio.run for celery tasks, closing the async clients of the new event
+    loop before it ends. use it to run the async methods of data provider and
+    kms outside of the api.
+    """
+
+    async def run() -> T:
+        try:
+            return await main
+        finally:
+            await aclose_async_clients()
+
+    return asyncio.run(run())
+
+
+class PooledHTTPXTransport(HTTPXTransport):
+    """
+    gql transport sending requests through a pooled client.
+    closing the transport leaves the pooled client open.
+    """
+
+    def __init__(self, url: str, client: httpx.Client, headers: Optional[dict] = None):
+        super().__init__(url)
+        self._pooled_client = client
+        self.headers = headers or {}
+
+    def connect(self):
+        self.client = self._pooled_client
+
+    def execute(  # type: ignore
+        self,
+        document: DocumentNode,
+        variable_values: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+        extra_args: Optional[Dict[str, Any]] = None,
+        upload_files: bool = False,
+    ) -> ExecutionResult:
+        extra_args = {"headers": self.headers, **(extra_args or {})}
+        return super().execute(
+            document, variable_values, operation_name, extra_args, upload_files
+        )
+
+    def close(self):
+        self.client = None
+
+
+class PooledHTTPXAsyncTransport(HTTPXAsyncTransport):
+    """
+    :class:`PooledHTTPXTransport` for async gql sessions.
+    """
+
+    def __init__(
+        self, url: str, client: httpx.AsyncClient, headers: Optional[dict] = None
+    ):
+        super().__init__(url)
+        self._pooled_client = client
+        self.headers = headers or {}
+
+    async def connect(self):
+        self.client = self._pooled_client
+
+    async def execute(
+        self,
+        document: DocumentNode,
+        variable_values: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+        extra_args: Optional[Dict[str, Any]] = None,
+        upload_files: bool = False,
+    ) -> ExecutionResult:
+        extra_args = {"headers": self.headers, **(extra_args or {})}
+        return await super().execute(
+            document, variable_values, operation_name, extra_args, upload_files
+        )
+
+    async def close(self):
+        self.client = None
@@ -10,8 +10,6 @@ import ethereum_kms_signer  # type: ignore
 from ethereum_kms_signer.spki import SPKIRecord  # type: ignore
 from gql import Client
 from gql.dsl import DSLMutation, DSLQuery, DSLSchema, dsl_gql
-from gql.transport.aiohttp import AIOHTTPTransport
-from gql.transport.requests import RequestsHTTPTransport
 from pyasn1.codec.der.decoder import decode as der_decode  # type: ignore
 from pyasn1.codec.der.encoder import encode as der_encode  # type: ignore
 from pyasn1.type.univ import Integer, SequenceOf  # type: ignore
@@ -19,11 +17,19 @@ from sqlalchemy.orm import Session
 
 from world_boss.app.config import config
 from world_boss.app.enums import NetworkType
+from world_boss.app.http_client import (
+    HEADLESS,
+    PooledHTTPXAsyncTransport,
+    PooledHTTPXTransport,
+    get_async_client,
+    get_client,
+)
 from world_boss.app.models import Transaction
 from world_boss.app.raid import (
     create_unsigned_tx,
     get_jwt_auth_header,
     get_transfer_assets_plain_value,
+    refresh_raid_rewards_cache,
 )
 from world_boss.app.stubs import CurrencyDictionary, Recipient
 
@@ -50,13 +56,15 @@ class KmsWorldBossSigner:
         return self._cached_address
 
     def _get_client(self, headless_url: str) -> Client:
-        transport = RequestsHTTPTransport(
-            url=headless_url, headers=get_jwt_auth_header()
+        transport = PooledHTTPXTransport(
+            headless_url, get_client(HEADLESS), headers=get_jwt_auth_header()
         )
         return Client(transport=transport, fetch_schema_from_transport=True)
 
     def _get_async_client(self, headless_url: str) -> Client:
-        transport = AIOHTTPTransport(url=headless_url, headers=get_jwt_auth_header())
+        transport = PooledHTTPXAsyncTransport(
+            headless_url, get_async_client(HEADLESS), headers=get_jwt_auth_header()
+        )
         return Client(transport=transport, fetch_schema_from_transport=True)
 
     def _sign_and_save(
@@ -162,6 +170,7 @@ class KmsWorldBossSigner:
             transaction.tx_result = tx_status
             db.add(transaction)
             db.commit()
+            refresh_raid_rewards_cache([tx_id], db)
             return tx_status
 
     def query_balance(self, headless_url: str, currency: CurrencyDictionary) -> str:
@@ -225,7 +234,10 @@ class KmsWorldBossSigner:
     ):
         headless_url = config.headless_url
         transactions = (
-            db.query(Transaction).filter_by(tx_result=None).order_by(Transaction.nonce)
+            db.query(Transaction)
+            .filter_by(tx_result=None)
+            .order_by(Transaction.nonce)
+            .all()
         )
         await asyncio.gather(
             *[
@@ -233,7 +245,10 @@ class KmsWorldBossSigner:
                 for transaction in transactions
             ]
         )
+        # read before commit, which expires every transaction
+        tx_ids = [t.tx_id for t in transactions if t.tx_result is not None]
         db.commit()
+        refresh_raid_rewards_cache(tx_ids, db)
 
     async def query_transaction_result_async(
         self, headless_url: str, transaction: Transaction, db: Session
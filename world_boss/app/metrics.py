@@ -0,0 +1,92 @@
+import os
+import socket
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+    push_to_gateway,
+)
+
+from world_boss.app.config import config
+
+__all__ = [
+    "CONTENT_TYPE_LATEST",
+    "LATENCY_BUCKETS",
+    "get_registry",
+    "mark_process_dead",
+    "push_metrics",
+    "render",
+]
+
+# redis round trips are well below the default buckets of prometheus_client
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def _multiprocess() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    registry of the metrics to expose.
+    with PROMETHEUS_MULTIPROC_DIR set, every uvicorn and celery worker process
+    writes its values under the directory, and the registry aggregates them.
+    """
+    if not _multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render() -> bytes:
+    """
+    metrics in the prometheus text exposition format.
+    """
+    return generate_latest(get_registry())
+
+
+def push_metrics():
+    """
+    push metrics to config.metrics_pushgateway_url, for celery workers running
+    on hosts that /metrics doesn't see. grouped by host, so with
+    PROMETHEUS_MULTIPROC_DIR set every worker process of the host is included.
+    without it each process only has its own values, so it is grouped by
+    process too, not to replace the values of the other processes.
+    """
+    if config.metrics_pushgateway_url:
+        grouping_key = {"instance": socket.gethostname()}
+        if not _multiprocess():
+            grouping_key["pid"] = str(os.getpid())
+        push_to_gateway(
+            config.metrics_pushgateway_url,
+            job="world_boss_worker",
+            registry=get_registry(),
+            grouping_key=grouping_key,
+        )
+
+
+def mark_process_dead(pid: Optional[int] = None):
+    """
+    drop live gauges of an exited process from the multiprocess directory.
+    """
+    if _multiprocess():
+        multiprocess.mark_process_dead(pid or os.getpid())
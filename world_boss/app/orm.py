@@ -1,11 +1,27 @@
+from typing import Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from world_boss.app.config import config
 
 SQLALCHEMY_DATABASE_URL = str(config.database_url)
+ASYNC_SQLALCHEMY_DATABASE_URL = make_url(SQLALCHEMY_DATABASE_URL).set(
+    drivername="postgresql+asyncpg"
+)
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async engine for the public read endpoints, through asyncpg. enabled with
+# ASYNC_DATABASE.
+AsyncSessionLocal: Optional[async_sessionmaker[AsyncSession]] = None
+if config.async_database:
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+
 Base = declarative_base()
@@ -1,27 +1,55 @@
 import calendar
 import csv
 import datetime
+import functools
 import hashlib
 import json
+import logging
+import time
 import typing
 import uuid
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, cast
 
 import bencodex
-import httpx
 import jwt
 from fastapi import HTTPException
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy import func, insert
+from sqlalchemy import Select, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import Response
 
-from world_boss.app.cache import cache_exists, get_from_cache, set_to_cache
+from world_boss.app.cache import (
+    add_to_negative_cache,
+    add_to_sorted_set,
+    bump_generation,
+    delete_from_cache,
+    get_from_cache,
+    get_from_hash,
+    get_many,
+    get_many_early_refresh,
+    get_raid_cache_namespace,
+    namespaced_key,
+    negative_cache_exists,
+    range_sorted_set_by_score,
+    set_many,
+    set_to_cache,
+    set_to_hash,
+    single_flight,
+    single_flight_async,
+)
 from world_boss.app.config import config
 from world_boss.app.enums import NetworkType
+from world_boss.app.http_client import HEADLESS, get_client
 from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
-from world_boss.app.schemas import WorldBossRewardSchema
+from world_boss.app.schemas import (
+    RaidRankingSchema,
+    WorldBossRewardAmountSchema,
+    WorldBossRewardSchema,
+)
 from world_boss.app.stubs import (
     ActionPlainValue,
     AmountDictionary,
@@ -38,36 +66,574 @@ from world_boss.app.stubs import (
     TransferAssetsValues,
 )
 
+MAX_REWARDS_BATCH_SIZE = 1000
+EXPORT_YIELD_PER = 1000
+MAX_RANKINGS_RANGE = 1000
+AGENT_ADDRESS_INDEX_KEY = "agent_address_index"
+# seasons whose rewards are in the avatar to agent index
+AGENT_ADDRESS_INDEXED_RAIDS_KEY = "agent_address_indexed_raids"
+# seasons whose rewards are in the leaderboard, even with no rewards at all
+RANKED_RAIDS_KEY = "ranked_raids"
+# short lived, to absorb polling for avatars not synced yet
+RAID_REWARDS_NOT_FOUND_TTL = datetime.timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
 
 def get_raid_rewards(
-    raid_id: int, avatar_address: str, db: Session, response: Response
-) -> WorldBossRewardSchema:
+    raid_id: int,
+    avatar_address: str,
+    db: Session,
+    response: Response,
+    if_none_match: typing.Optional[str] = None,
+) -> typing.Union[WorldBossRewardSchema, Response]:
     avatar_address = avatar_address.replace("0x", "")
 
-    cache_key = f"raid_rewards_{avatar_address}_{raid_id}_json"
-    if cache_exists(cache_key):
-        cached_value = get_from_cache(cache_key)
-        cached_result = json.loads(cached_value)
-        result = WorldBossRewardSchema.parse_obj(cached_result)
-        response.headers["X-world-boss-service-response-cached"] = cache_key
-        return result
-
-    reward = (
-        db.query(WorldBossReward)
-        .filter_by(
-            raid_id=raid_id,
-            avatar_address=avatar_address,
+    def load() -> typing.Optional[Response]:
+        _check_raid_rewards_not_found(raid_id, avatar_address)
+        return _get_cached_raid_rewards(raid_id, avatar_address, if_none_match)[0]
+
+    def build() -> typing.Union[WorldBossRewardSchema, Response]:
+        started_at = time.monotonic()
+        rewards = query_reward_schemas(
+            db,
+            WorldBossReward.raid_id == raid_id,
+            WorldBossReward.avatar_address == avatar_address,
         )
-        .first()
+        return _cache_raid_rewards(
+            raid_id,
+            avatar_address,
+            rewards,
+            response,
+            if_none_match,
+            time.monotonic() - started_at,
+        )
+
+    cached_response, refresh = _get_cached_raid_rewards(
+        raid_id, avatar_address, if_none_match
     )
-    if reward is None:
+    if cached_response is not None and not refresh:
+        return cached_response
+    if cached_response is None:
+        _check_raid_rewards_not_found(raid_id, avatar_address)
+    cache_key = get_raid_rewards_cache_key(raid_id, avatar_address)
+    # while refreshing early, other callers keep getting the cached response
+    return single_flight(cache_key, build, load, stale=cached_response)
+
+
+async def get_raid_rewards_async(
+    raid_id: int,
+    avatar_address: str,
+    db: AsyncSession,
+    response: Response,
+    if_none_match: typing.Optional[str] = None,
+) -> typing.Union[WorldBossRewardSchema, Response]:
+    avatar_address = avatar_address.replace("0x", "")
+
+    def load() -> typing.Optional[Response]:
+        _check_raid_rewards_not_found(raid_id, avatar_address)
+        return _get_cached_raid_rewards(raid_id, avatar_address, if_none_match)[0]
+
+    async def build() -> typing.Union[WorldBossRewardSchema, Response]:
+        started_at = time.monotonic()
+        rewards = await query_reward_schemas_async(
+            db,
+            WorldBossReward.raid_id == raid_id,
+            WorldBossReward.avatar_address == avatar_address,
+        )
+        return await run_in_threadpool(
+            _cache_raid_rewards,
+            raid_id,
+            avatar_address,
+            rewards,
+            response,
+            if_none_match,
+            time.monotonic() - started_at,
+        )
+
+    # the redis client is blocking, so it is kept off the event loop
+    cached_response, refresh = await run_in_threadpool(
+        _get_cached_raid_rewards, raid_id, avatar_address, if_none_match
+    )
+    if cached_response is not None and not refresh:
+        return cached_response
+    if cached_response is None:
+        await run_in_threadpool(_check_raid_rewards_not_found, raid_id, avatar_address)
+    # the key reads the season generation from redis
+    cache_key = await run_in_threadpool(
+        get_raid_rewards_cache_key, raid_id, avatar_address
+    )
+    # while refreshing early, other callers keep getting the cached response
+    return await single_flight_async(cache_key, build, load, stale=cached_response)
+
+
+def _get_cached_raid_rewards(
+    raid_id: int, avatar_address: str, if_none_match: typing.Optional[str]
+) -> Tuple[typing.Optional[Response], bool]:
+    """
+    return cached reward json as is, without parsing or re-serializing it.
+    conditional requests are answered from the cached etag alone.
+    :return: cached response, and True if the entry should be refreshed early.
+    """
+    cache_key = get_raid_rewards_cache_key(raid_id, avatar_address)
+    etag_key = get_raid_rewards_etag_cache_key(raid_id, avatar_address)
+    if if_none_match is not None:
+        (cached_etag,), refresh = get_many_early_refresh([etag_key])
+        if cached_etag is not None and etag_matches(
+            if_none_match, _decode(cached_etag)
+        ):
+            return (
+                Response(status_code=304, headers={"ETag": _decode(cached_etag)}),
+                refresh,
+            )
+    (cached_value, cached_etag), refresh = get_many_early_refresh([cache_key, etag_key])
+    if cached_value is None:
+        return None, False
+    headers = {"X-world-boss-service-response-cached": cache_key}
+    if cached_etag is not None:
+        headers["ETag"] = _decode(cached_etag)
+    return (
+        Response(
+            content=cached_value,
+            media_type="application/json",
+            headers=headers,
+        ),
+        refresh,
+    )
+
+
+def _check_raid_rewards_not_found(raid_id: int, avatar_address: str):
+    not_found_key = get_raid_rewards_not_found_cache_key(raid_id)
+    if negative_cache_exists(not_found_key, avatar_address):
+        raise HTTPException(status_code=404, detail="WorldBossReward not found")
+
+
+def _cache_raid_rewards(
+    raid_id: int,
+    avatar_address: str,
+    rewards: List[WorldBossRewardSchema],
+    response: Response,
+    if_none_match: typing.Optional[str],
+    delta: typing.Optional[float] = None,
+) -> typing.Union[WorldBossRewardSchema, Response]:
+    """
+    :param delta: seconds it took to query rewards, for early refresh.
+    """
+    if not rewards:
+        add_to_negative_cache(
+            get_raid_rewards_not_found_cache_key(raid_id),
+            avatar_address,
+            RAID_REWARDS_NOT_FOUND_TTL,
+        )
         raise HTTPException(status_code=404, detail="WorldBossReward not found")
-    result = reward.as_schema()
-    serialized = json.dumps(jsonable_encoder(result))
-    set_to_cache(cache_key, serialized)
+    result = rewards[0]
+    serialized = _serialize_raid_rewards([result])
+    set_many(
+        serialized,
+        deltas=None if delta is None else dict.fromkeys(serialized, delta),
+    )
+    etag = serialized[get_raid_rewards_etag_cache_key(raid_id, avatar_address)]
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return result
 
 
+def get_raid_rewards_etag(serialized: str) -> str:
+    """
+    version tag of a serialized reward. it changes with any amount or tx_result.
+    """
+    return '"%s"' % hashlib.sha1(serialized.encode()).hexdigest()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
+
+
+def _decode(value: typing.Union[str, bytes]) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def get_raid_rewards_batch(
+    raid_id: int, avatar_addresses: List[str], db: Session
+) -> List[WorldBossRewardSchema]:
+    """
+    get rewards of many avatars in one season.
+    cache hits are resolved with one MGET and misses are loaded with one query.
+    :param raid_id: target season id.
+    :param avatar_addresses: target avatar addresses.
+    :return: found rewards in requested order. unknown avatars are omitted.
+    """
+    if len(avatar_addresses) > MAX_REWARDS_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"avatar addresses must not exceed {MAX_REWARDS_BATCH_SIZE}",
+        )
+    avatar_addresses = list(
+        dict.fromkeys(a.replace("0x", "") for a in avatar_addresses)
+    )
+    cache_keys = [get_raid_rewards_cache_key(raid_id, a) for a in avatar_addresses]
+    # avatar_address : world_boss_reward schema
+    results: dict[str, WorldBossRewardSchema] = {}
+    missed_addresses: List[str] = []
+    for avatar_address, cached_value in zip(avatar_addresses, get_many(cache_keys)):
+        if cached_value is None:
+            missed_addresses.append(avatar_address)
+        else:
+            results[avatar_address] = WorldBossRewardSchema.parse_raw(cached_value)
+
+    if missed_addresses:
+        rewards = query_reward_schemas(
+            db,
+            WorldBossReward.raid_id == raid_id,
+            WorldBossReward.avatar_address.in_(missed_addresses),
+        )
+        for reward in rewards:
+            results.setdefault(reward.avatarAddress, reward)
+        set_many(_serialize_raid_rewards(rewards))
+    return [results[a] for a in avatar_addresses if a in results]
+
+
+def iter_raid_rewards_ndjson(
+    raid_id: int,
+    db: Session,
+    after_ranking: typing.Optional[int] = None,
+    after_avatar_address: typing.Optional[str] = None,
+) -> typing.Iterator[str]:
+    """
+    stream every reward of the season as NDJSON in ranking order.
+    rows are read through a server-side cursor, so memory stays constant.
+    :param raid_id: target season id.
+    :param db:
+    :param after_ranking: keyset cursor. resume after this ranking.
+    :param after_avatar_address: keyset cursor. resume after this avatar of
+        after_ranking.
+    """
+    criteria = [WorldBossReward.raid_id == raid_id]
+    if after_ranking is not None:
+        if after_avatar_address is None:
+            criteria.append(WorldBossReward.ranking > after_ranking)
+        else:
+            criteria.append(
+                tuple_(WorldBossReward.ranking, WorldBossReward.avatar_address)
+                > tuple_(after_ranking, after_avatar_address.replace("0x", ""))
+            )
+    query = (
+        select_reward_rows(*criteria)
+        .order_by(None)
+        .order_by(
+            WorldBossReward.ranking,
+            WorldBossReward.avatar_address,
+            WorldBossReward.id,
+            WorldBossRewardAmount.id,
+        )
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+    for reward in iter_reward_schemas(db.execute(query)):
+        yield reward.json() + "\n"
+
+
+def get_agent_rewards(
+    agent_address: str, raid_id: typing.Optional[int], db: Session
+) -> typing.Union[List[WorldBossRewardSchema], Response]:
+    """
+    get rewards of every avatar of the agent in one query.
+    :param agent_address: target agent address.
+    :param raid_id: target season id. every season if None.
+    :param db:
+    """
+    cache_key = get_agent_rewards_cache_key(agent_address, raid_id)
+    cached_value = get_from_cache(cache_key)
+    if cached_value is not None:
+        return Response(
+            content=cached_value,
+            media_type="application/json",
+            headers={"X-world-boss-service-response-cached": cache_key},
+        )
+    criteria = [WorldBossReward.agent_address == agent_address]
+    if raid_id is not None:
+        criteria.append(WorldBossReward.raid_id == raid_id)
+    rewards = query_reward_schemas(db, *criteria)
+    set_to_cache(cache_key, json.dumps(jsonable_encoder(rewards)))
+    return rewards
+
+
+def warm_raid_rewards_cache(
+    raid_id: int, avatar_addresses: typing.Collection[str], db: Session
+):
+    """
+    write reward cache entries of avatars through one pipeline right after their
+    rewards are committed, so the first client requests are served from cache.
+    :param raid_id: target season id.
+    :param avatar_addresses: avatar addresses with newly written rewards.
+    :param db:
+    """
+    invalidate_raid_rewards_cache(raid_id)
+    if not avatar_addresses:
+        return
+    rewards = query_reward_schemas(
+        db,
+        WorldBossReward.raid_id == raid_id,
+        WorldBossReward.avatar_address.in_(list(avatar_addresses)),
+    )
+    set_many(_serialize_raid_rewards(rewards))
+    invalidate_agent_rewards_cache(rewards)
+    index_agent_addresses({r.avatarAddress: r.agentAddress for r in rewards})
+    if not is_raid_ranked(raid_id):
+        # seasons synced before the leaderboard existed are filled as a whole
+        backfill_raid_rankings(raid_id, db)
+        return
+    # the best ranking of avatar, like backfill_raid_rankings
+    rankings: dict[str, int] = {}
+    for r in rewards:
+        rankings[r.avatarAddress] = min(
+            r.ranking, rankings.get(r.avatarAddress, r.ranking)
+        )
+    add_to_sorted_set(get_raid_rankings_cache_key(raid_id), rankings)
+
+
+def backfill_raid_rankings(raid_id: int, db: Session) -> int:
+    """
+    fill the season leaderboard in redis from its rewards in the database.
+    :return: number of ranked avatars.
+    """
+    query = (
+        select(WorldBossReward.avatar_address, func.min(WorldBossReward.ranking))
+        .filter_by(raid_id=raid_id)
+        .group_by(WorldBossReward.avatar_address)
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+    count = 0
+    for rows in db.execute(query).partitions():
+        add_to_sorted_set(get_raid_rankings_cache_key(raid_id), dict(rows))
+        count += len(rows)
+    set_to_hash(RANKED_RAIDS_KEY, {str(raid_id): "1"})
+    return count
+
+
+def is_raid_ranked(raid_id: int) -> bool:
+    """
+    whether the season leaderboard was filled by :func:`backfill_raid_rankings`.
+    """
+    return get_from_hash(RANKED_RAIDS_KEY, [str(raid_id)])[0] is not None
+
+
+def get_raid_rankings(
+    raid_id: int, start: int, stop: int, db: Session
+) -> List[RaidRankingSchema]:
+    """
+    get raiders ranked from start to stop, both inclusive, from the season
+    leaderboard in redis. the database is only read once to fill a missing
+    leaderboard.
+    """
+    if stop < start or stop - start >= MAX_RANKINGS_RANGE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"rankings range must be between 1 and {MAX_RANKINGS_RANGE}",
+        )
+    if not is_raid_ranked(raid_id):
+        backfill_raid_rankings(raid_id, db)
+    return [
+        RaidRankingSchema(avatarAddress=member.decode(), ranking=int(score))
+        for member, score in range_sorted_set_by_score(
+            get_raid_rankings_cache_key(raid_id), start, stop
+        )
+    ]
+
+
+def refresh_raid_rewards_cache(tx_ids: typing.Collection[str], db: Session):
+    """
+    rewrite cached rewards of every avatar whose amounts reference tx_ids, so the
+    embedded tx_result follows transaction status changes.
+    :param tx_ids: transactions with updated tx_result.
+    :param db:
+    """
+    if not tx_ids:
+        return
+    reward_ids = select(WorldBossRewardAmount.reward_id).filter(
+        WorldBossRewardAmount.tx_id.in_(list(tx_ids))
+    )
+    rewards = query_reward_schemas(db, WorldBossReward.id.in_(reward_ids))
+    set_many(_serialize_raid_rewards(rewards))
+    invalidate_agent_rewards_cache(rewards)
+
+
+def invalidate_agent_rewards_cache(rewards: typing.Iterable[WorldBossRewardSchema]):
+    """
+    invalidate agent reward cache entries that include rewards.
+    """
+    cache_keys: typing.Set[str] = set()
+    for reward in rewards:
+        cache_keys.add(get_agent_rewards_cache_key(reward.agentAddress, reward.raidId))
+        cache_keys.add(get_agent_rewards_cache_key(reward.agentAddress, None))
+    delete_from_cache(*cache_keys)
+
+
+def _serialize_raid_rewards(
+    rewards: typing.Iterable[WorldBossRewardSchema],
+) -> dict[str, str]:
+    # cache_key : serialized world_boss_reward or its etag.
+    # first reward of avatar is used.
+    serialized: dict[str, str] = {}
+    for reward in rewards:
+        cache_key = get_raid_rewards_cache_key(reward.raidId, reward.avatarAddress)
+        if cache_key not in serialized:
+            value = json.dumps(jsonable_encoder(reward))
+            etag_key = get_raid_rewards_etag_cache_key(
+                reward.raidId, reward.avatarAddress
+            )
+            serialized[cache_key] = value
+            serialized[etag_key] = get_raid_rewards_etag(value)
+    return serialized
+
+
+def get_raid_rewards_cache_key(raid_id: int, avatar_address: str) -> str:
+    return namespaced_key(
+        get_raid_cache_namespace(raid_id),
+        f"raid_rewards_{avatar_address}_{raid_id}_json",
+    )
+
+
+def get_raid_rewards_etag_cache_key(raid_id: int, avatar_address: str) -> str:
+    return namespaced_key(
+        get_raid_cache_namespace(raid_id),
+        f"raid_rewards_{avatar_address}_{raid_id}_etag",
+    )
+
+
+def get_agent_rewards_cache_key(
+    agent_address: str, raid_id: typing.Optional[int]
+) -> str:
+    if raid_id is None:
+        return f"agent_rewards_{agent_address}_all_json"
+    return namespaced_key(
+        get_raid_cache_namespace(raid_id),
+        f"agent_rewards_{agent_address}_{raid_id}_json",
+    )
+
+
+def get_raid_rankings_cache_key(raid_id: int) -> str:
+    return f"raid_rankings_{raid_id}"
+
+
+def get_raid_rewards_not_found_cache_key(raid_id: int) -> str:
+    return namespaced_key(
+        get_raid_cache_namespace(raid_id), f"raid_rewards_{raid_id}_not_found"
+    )
+
+
+def get_agent_addresses_cache_key(
+    raid_id: int, network_type: NetworkType, offset: int, limit: int
+) -> str:
+    return namespaced_key(
+        get_raid_cache_namespace(raid_id),
+        f"world_boss_agents_{raid_id}_{network_type}_{offset}_{limit}",
+    )
+
+
+def invalidate_raid_rewards_cache(raid_id: int):
+    """
+    invalidate reward cache entries of the season after its rewards are written.
+    """
+    delete_from_cache(get_raid_rewards_not_found_cache_key(raid_id))
+
+
+def invalidate_raid_cache(raid_id: int) -> int:
+    """
+    invalidate every cached entry of the season at once: rewards, agent rewards,
+    data provider ranking pages and agent address pages.
+    the upload marker and the rankings leaderboard are kept.
+    :return: new cache generation of the season.
+    """
+    return bump_generation(get_raid_cache_namespace(raid_id))
+
+
+def select_reward_rows(*criteria) -> Select:
+    """
+    select world boss rewards with their amounts and each amount's tx_result in one
+    joined query, ordered by reward and amount.
+    :param criteria: filter criteria for the query.
+    """
+    return (
+        select(
+            WorldBossReward.id,
+            WorldBossReward.avatar_address,
+            WorldBossReward.agent_address,
+            WorldBossReward.raid_id,
+            WorldBossReward.ranking,
+            WorldBossRewardAmount.amount,
+            WorldBossRewardAmount.ticker,
+            WorldBossRewardAmount.tx_id,
+            WorldBossRewardAmount.decimal_places,
+            Transaction.tx_result,
+        )
+        .outerjoin(
+            WorldBossRewardAmount, WorldBossReward.id == WorldBossRewardAmount.reward_id
+        )
+        .outerjoin(Transaction, Transaction.tx_id == WorldBossRewardAmount.tx_id)
+        .filter(*criteria)
+        .order_by(WorldBossReward.id, WorldBossRewardAmount.id)
+    )
+
+
+def rows_to_reward_schemas(rows: typing.Iterable) -> List[WorldBossRewardSchema]:
+    """
+    build reward schemas from rows selected by :func:`select_reward_rows`.
+    """
+    return list(iter_reward_schemas(rows))
+
+
+def iter_reward_schemas(
+    rows: typing.Iterable,
+) -> typing.Iterator[WorldBossRewardSchema]:
+    """
+    build reward schemas lazily. rows of a reward must be consecutive, as ordered by
+    :func:`select_reward_rows`.
+    """
+    reward_id = None
+    schema = None
+    for row in rows:
+        if row.id != reward_id:
+            if schema is not None:
+                yield schema
+            reward_id = row.id
+            schema = WorldBossRewardSchema(
+                avatarAddress=row.avatar_address,
+                agentAddress=row.agent_address,
+                raidId=row.raid_id,
+                ranking=row.ranking,
+                rewards=[],
+            )
+        # reward without amounts
+        if row.tx_id is None:
+            continue
+        schema.rewards.append(
+            WorldBossRewardAmountSchema(
+                amount=int(row.amount),
+                ticker=row.ticker,
+                tx_id=row.tx_id,
+                decimal_places=row.decimal_places,
+                tx_result=row.tx_result,
+            )
+        )
+    if schema is not None:
+        yield schema
+
+
+def query_reward_schemas(db: Session, *criteria) -> List[WorldBossRewardSchema]:
+    return rows_to_reward_schemas(db.execute(select_reward_rows(*criteria)))
+
+
+async def query_reward_schemas_async(
+    db: AsyncSession, *criteria
+) -> List[WorldBossRewardSchema]:
+    result = await db.execute(select_reward_rows(*criteria))
+    return rows_to_reward_schemas(result)
+
+
 def update_agent_address(
     results: List[RankingRewardDictionary],
     raid_id: int,
@@ -75,56 +641,136 @@ def update_agent_address(
     offset: int,
     limit: int,
 ) -> List[RankingRewardWithAgentDictionary]:
-    cache_key = f"world_boss_agents_{raid_id}_{network_type}_{offset}_{limit}"
-    if cache_exists(cache_key):
-        cached_value = get_from_cache(cache_key)
+    cache_key = get_agent_addresses_cache_key(raid_id, network_type, offset, limit)
+    cached_value = get_from_cache(cache_key)
+    if cached_value is not None:
         return json.loads(cached_value)
     else:
-        http_client = httpx.Client(timeout=None, headers=get_jwt_auth_header())
         rewards: List[RankingRewardWithAgentDictionary] = []
-        query_keys = [r["raider"]["address"] for r in results]
-        alias_key_format = "arg{}"
-        variables_format = "$arg{}: Address!"
-        query_format = """
-        {0}: avatar(avatarAddress: ${0}) {{
-              agentAddress
-              level
-              name
-            }}
-        """
-        base_query_format = """
-        query({}) {{
-          stateQuery {{
-          {}
-          }}
-        }}
-        """
-        variables_keys = ", ".join(variables_format.format(a) for a in query_keys)
-        avatar_queries = "\n".join(
-            query_format.format(alias_key_format.format(i)) for i in query_keys
-        )
-        query = base_query_format.format(variables_keys, avatar_queries)
-        variables = {}
-        for avatar_address in query_keys:
-            variables[f"arg{avatar_address}"] = avatar_address
-        req = http_client.post(
-            config.headless_url, json={"query": query, "variables": variables}
-        )
-        query_result = req.json()
-        agents = query_result["data"]["stateQuery"]
+        avatar_addresses = list(dict.fromkeys(r["raider"]["address"] for r in results))
+        agent_addresses = get_indexed_agent_addresses(avatar_addresses)
+        # only avatars never seen before are asked to headless
+        unknown_addresses = [a for a in avatar_addresses if a not in agent_addresses]
+        if unknown_addresses:
+            logger.info(
+                "query %d agent addresses of season %d to headless",
+                len(unknown_addresses),
+                raid_id,
+            )
+            queried = query_agent_addresses(unknown_addresses)
+            index_agent_addresses(queried)
+            agent_addresses.update(queried)
         for result in results:
             avatar_address = result["raider"]["address"]
             r: RankingRewardWithAgentDictionary = cast(
                 RankingRewardWithAgentDictionary, result
             )
-            r["raider"]["agent_address"] = agents[f"arg{avatar_address}"][
-                "agentAddress"
-            ]
+            r["raider"]["agent_address"] = agent_addresses[avatar_address]
             rewards.append(r)
         set_to_cache(cache_key, json.dumps(rewards))
         return rewards
 
 
+def query_agent_addresses(avatar_addresses: List[str]) -> dict[str, str]:
+    """
+    query agent addresses of avatars to headless, in concurrent chunks spread
+    over the headless urls.
+    :return: avatar_address : agent_address
+    """
+    chunk_size = config.agent_address_chunk_size
+    chunks = [
+        avatar_addresses[i : i + chunk_size]
+        for i in range(0, len(avatar_addresses), chunk_size)
+    ]
+    urls = config.headless_urls or [config.headless_url]
+    agent_addresses: dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=config.agent_address_concurrency) as executor:
+        for result in executor.map(
+            _query_agent_addresses_chunk,
+            chunks,
+            [urls[i % len(urls)] for i in range(len(chunks))],
+        ):
+            agent_addresses.update(result)
+    return agent_addresses
+
+
+def _query_agent_addresses_chunk(
+    avatar_addresses: List[str], headless_url: str
+) -> dict[str, str]:
+    req = get_client(HEADLESS).post(
+        headless_url,
+        json={
+            "query": get_agent_addresses_query(len(avatar_addresses)),
+            "variables": {f"a{i}": a for i, a in enumerate(avatar_addresses)},
+        },
+        headers=get_jwt_auth_header(),
+    )
+    agents = req.json()["data"]["stateQuery"]
+    return {
+        avatar_address: agents[f"a{i}"]["agentAddress"]
+        for i, avatar_address in enumerate(avatar_addresses)
+    }
+
+
+@functools.lru_cache(maxsize=32)
+def get_agent_addresses_query(size: int) -> str:
+    """
+    avatar state query of size avatars, aliased by index so the same text is
+    reused for every chunk of the size and only variables change.
+    """
+    variables = ", ".join(f"$a{i}: Address!" for i in range(size))
+    avatars = "\n".join(
+        f"a{i}: avatar(avatarAddress: $a{i}) {{ agentAddress }}" for i in range(size)
+    )
+    return f"query({variables}) {{\n  stateQuery {{\n{avatars}\n  }}\n}}"
+
+
+def get_indexed_agent_addresses(avatar_addresses: List[str]) -> dict[str, str]:
+    """
+    get agent addresses of avatars from the avatar to agent index.
+    the agent of an avatar never changes, so the index never expires.
+    :return: avatar_address : agent_address of indexed avatars only.
+    """
+    values = get_from_hash(AGENT_ADDRESS_INDEX_KEY, avatar_addresses)
+    return {
+        avatar_address: _decode(value)
+        for avatar_address, value in zip(avatar_addresses, values)
+        if value is not None
+    }
+
+
+def index_agent_addresses(agent_addresses: typing.Mapping[str, str]):
+    """
+    :param agent_addresses: avatar_address : agent_address
+    """
+    set_to_hash(AGENT_ADDRESS_INDEX_KEY, agent_addresses)
+
+
+def backfill_agent_address_index(db: Session) -> int:
+    """
+    fill the avatar to agent index from the rewards of every season not
+    indexed yet. a season is marked after all of its rewards are indexed, so an
+    interrupted backfill is completed on the next call.
+    :return: number of indexed avatars.
+    """
+    raid_ids = [r for r, in db.execute(select(WorldBossReward.raid_id).distinct())]
+    indexed = get_from_hash(AGENT_ADDRESS_INDEXED_RAIDS_KEY, [str(r) for r in raid_ids])
+    count = 0
+    for raid_id, value in zip(raid_ids, indexed):
+        if value is not None:
+            continue
+        query = (
+            select(WorldBossReward.avatar_address, WorldBossReward.agent_address)
+            .filter_by(raid_id=raid_id)
+            .execution_options(yield_per=EXPORT_YIELD_PER)
+        )
+        for rows in db.execute(query).partitions():
+            index_agent_addresses(dict(rows))
+            count += len(rows)
+        set_to_hash(AGENT_ADDRESS_INDEXED_RAIDS_KEY, {str(raid_id): "1"})
+    return count
+
+
 def write_ranking_rewards_csv(
     file_name: str,
     reward_list: List[RankingRewardWithAgentDictionary],
@@ -507,6 +1153,7 @@ def bulk_insert_transactions(
     if values:
         db.execute(insert(WorldBossRewardAmount), values)
         db.commit()
+        warm_raid_rewards_cache(raid_id, world_boss_rewards.keys(), db)
 
 
 def get_claim_items_plain_value(
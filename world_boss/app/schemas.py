@@ -17,3 +17,8 @@ class WorldBossRewardSchema(BaseModel):
     raidId: int
     ranking: int
     rewards: typing.List[WorldBossRewardAmountSchema]
+
+
+class RaidRankingSchema(BaseModel):
+    avatarAddress: str
+    ranking: int
@@ -6,17 +6,27 @@ from typing import List, Tuple
 
 import bencodex
 from celery import Celery, chord
+from celery.signals import task_postrun, worker_process_shutdown
 from sqlalchemy import create_engine, insert
 from sqlalchemy.orm import sessionmaker
 
-from world_boss.app.cache import cache_exists, set_to_cache
+from world_boss.app.cache import cache_exists, delete_from_cache, set_to_cache
 from world_boss.app.config import config
-from world_boss.app.data_provider import data_provider_client
+from world_boss.app.data_provider import (
+    RankingRewardsCollector,
+    RankingRewardsException,
+    data_provider_client,
+    get_ranking_rewards_cache_key,
+)
 from world_boss.app.enums import NetworkType
+from world_boss.app.http_client import run_async
 from world_boss.app.kms import signer
+from world_boss.app.metrics import mark_process_dead, push_metrics
 from world_boss.app.models import Transaction, WorldBossReward, WorldBossRewardAmount
 from world_boss.app.raid import (
+    backfill_agent_address_index,
     bulk_insert_transactions,
+    get_agent_addresses_cache_key,
     get_assets,
     get_latest_raid_id,
     get_next_month_last_day,
@@ -25,6 +35,7 @@ from world_boss.app.raid import (
     get_reward_count,
     get_tx_delay_factor,
     update_agent_address,
+    warm_raid_rewards_cache,
     write_ranking_rewards_csv,
     write_tx_result_csv,
 )
@@ -32,6 +43,7 @@ from world_boss.app.slack import client
 from world_boss.app.stubs import (
     CurrencyDictionary,
     RaiderWithAgentDictionary,
+    RankingRewardDictionary,
     RankingRewardWithAgentDictionary,
     Recipient,
     RecipientRow,
@@ -47,6 +59,16 @@ task_engine = create_engine(str(config.database_url))
 TaskSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=task_engine)
 
 
+@task_postrun.connect
+def push_task_metrics(**kwargs):
+    push_metrics()
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(pid: int, **kwargs):
+    mark_process_dead(pid)
+
+
 @celery.task()
 def count_users(channel_id: str, raid_id: int):
     total_count = data_provider_client.get_total_users_count(raid_id)
@@ -58,31 +80,72 @@ def count_users(channel_id: str, raid_id: int):
 
 @celery.task()
 def get_ranking_rewards(
-    channel_id: str, raid_id: int, total_count: int, start_nonce: int, size: int
+    channel_id: str,
+    raid_id: int,
+    total_count: int,
+    start_nonce: int,
+    size: int,
+    payload_size: typing.Optional[int] = None,
 ):
-    offset = 0
-    results: List[RankingRewardWithAgentDictionary] = []
-    payload_size = size
-    while len(results) < total_count:
-        try:
-            result = data_provider_client.get_ranking_rewards(
-                raid_id, NetworkType.MAIN, offset, payload_size
-            )
-        except Exception as e:
-            client.chat_postMessage(
-                channel=channel_id,
-                text=f"failed to get rewards from {config.data_provider_url} exc: {e}",
+    """
+    upload ranking rewards csv of the season on Slack channel.
+    :param size: transfer_assets recipients size each tx in the csv
+    :param payload_size: request payload size to data provider. adapts to the
+        data provider latency if not given.
+    """
+    results = RankingRewardsCollector()
+    page_size = payload_size or data_provider_client.page_size.size
+    try:
+        pages = run_async(
+            data_provider_client.get_ranking_rewards_range_async(
+                raid_id, NetworkType.MAIN, 0, total_count, page_size
             )
-            raise e
+        )
+    except Exception as e:
+        client.chat_postMessage(
+            channel=channel_id,
+            text=f"failed to get rewards from {config.data_provider_url} exc: {e}",
+        )
+        raise e
+    # offset after the rewards collected from a page : rewards missing from the
+    # page, for pages that came back short or overlapped other pages
+    missing_ranges: dict[int, int] = {}
+    for page_offset, page in zip(range(0, total_count, page_size), pages):
+        page_limit = min(page_size, total_count - page_offset)
         rewards = update_agent_address(
-            result, raid_id, NetworkType.MAIN, offset, payload_size
+            page, raid_id, NetworkType.MAIN, page_offset, page_limit
         )
-        results.extend(reward for reward in rewards if reward not in results)
-        offset = len(results)
-        payload_size = min(payload_size, total_count - offset)
+        added = len(rewards) - results.extend(rewards)
+        if added < page_limit:
+            missing_ranges[page_offset + added] = page_limit - added
+    for offset, missing in missing_ranges.items():
+        # the same range would return the same rewards again, so the shortfall
+        # is fetched from after the collected rewards
+        while missing > 0:
+            try:
+                rewards = _refetch_ranking_rewards(raid_id, offset, missing)
+                added = len(rewards) - results.extend(rewards)
+                if not added:
+                    raise RankingRewardsException(
+                        f"no new rewards between {offset} and "
+                        f"{offset + missing} of season {raid_id}"
+                    )
+            except Exception as e:
+                client.chat_postMessage(
+                    channel=channel_id,
+                    text=f"failed to get rewards from {config.data_provider_url} exc: {e}",
+                )
+                raise e
+            offset += len(rewards)
+            missing -= added
+    if missing_ranges:
+        # refetched rewards were appended after the others
+        results.rewards.sort(key=lambda r: r["raider"]["ranking"])
     with NamedTemporaryFile(suffix=".csv") as temp_file:
         file_name = temp_file.name
-        write_ranking_rewards_csv(file_name, results, raid_id, start_nonce, size)
+        write_ranking_rewards_csv(
+            file_name, results.rewards, raid_id, start_nonce, size
+        )
         result_format = (
             f"world_boss_{raid_id}_{total_count}_{start_nonce}_{size}_result"
         )
@@ -91,9 +154,30 @@ def get_ranking_rewards(
             title=result_format,
             filename=f"{result_format}.csv",
             file=file_name,
+            # the adapted size and duplicates are kept in the worker process only
+            initial_comment=f"page size: {page_size}, "
+            f"next page size: {data_provider_client.page_size.size}, "
+            f"dropped duplicates: {results.duplicates}",
         )
 
 
+def _refetch_ranking_rewards(
+    raid_id: int, offset: int, limit: int
+) -> List[RankingRewardWithAgentDictionary]:
+    """
+    fetch the range again, skipping a cached page of the range and its agent
+    addresses.
+    """
+    delete_from_cache(
+        get_ranking_rewards_cache_key(raid_id, NetworkType.MAIN, offset, limit),
+        get_agent_addresses_cache_key(raid_id, NetworkType.MAIN, offset, limit),
+    )
+    page = data_provider_client.get_ranking_rewards(
+        raid_id, NetworkType.MAIN, offset, limit
+    )
+    return update_agent_address(page, raid_id, NetworkType.MAIN, offset, limit)
+
+
 @celery.task()
 def sign_transfer_assets(
     time_string: str,
@@ -166,6 +250,7 @@ def insert_world_boss_rewards(rows: List[RecipientRow], signer_address: str):
         if values:
             db.execute(insert(WorldBossRewardAmount), values)
             db.commit()
+            warm_raid_rewards_cache(raid_id, {row[3] for row in rows}, db)
 
 
 @celery.task()
@@ -247,6 +332,8 @@ def stage_transactions_with_countdown(headless_url: str, nonce_list: List[int]):
 def check_season():
     with TaskSessionLocal() as db:
         raid_id = get_latest_raid_id(db)
+        # avatars of past seasons don't need headless lookups
+        backfill_agent_address_index(db)
         total_count = data_provider_client.get_total_users_count(raid_id)
         sync_count = get_reward_count(db, raid_id)
         # 최신 시즌 동기화 처리
@@ -257,7 +344,7 @@ def check_season():
         if total_count > 0:
             save_ranking_rewards(
                 raid_id=raid_id,
-                payload_size=500,
+                payload_size=None,
                 recipients_size=50,
                 total_count=total_count,
             )
@@ -265,16 +352,20 @@ def check_season():
 
 @celery.task()
 def save_ranking_rewards(
-    raid_id: int, payload_size: int, recipients_size: int, total_count: int
+    raid_id: int,
+    payload_size: typing.Optional[int],
+    recipients_size: int,
+    total_count: int,
 ):
     """
 
     :param raid_id: target season id
-    :param payload_size: request payload size to data provider
+    :param payload_size: request payload size to data provider. adapts to the
+        data provider latency if None
     :param recipients_size: transfer_assets recipients size each tx
     :param total_count: target season total user count
     """
-    results: List[RankingRewardWithAgentDictionary] = []
+    results = RankingRewardsCollector()
     time_stamp = get_next_month_last_day()
     memo = "world boss ranking rewards by world boss signer"
     offset = 0
@@ -289,26 +380,26 @@ def save_ranking_rewards(
                 )
             ]
         )
-        while True:
-            result = data_provider_client.get_ranking_rewards(
-                raid_id, NetworkType.MAIN, offset, payload_size
-            )
+        result: List[RankingRewardDictionary] = []
+        # first page with avatars not synced yet
+        for result in data_provider_client.iter_ranking_rewards(
+            raid_id, payload_size, NetworkType.MAIN, total_count=total_count
+        ):
             avatar_addresses: typing.Set[str] = set(
                 [r["raider"]["address"] for r in result]
             )
             target_avatar_addresses = avatar_addresses - exist_avatar_addresses
             if len(target_avatar_addresses) > 0 or offset >= total_count:
                 break
-            else:
-                offset += payload_size
+            offset += len(result)
         rewards = update_agent_address(
-            result, raid_id, NetworkType.MAIN, offset, payload_size
+            result, raid_id, NetworkType.MAIN, offset, payload_size or len(result)
         )
-        results.extend(reward for reward in rewards if reward not in results)
+        results.extend(rewards)
         nonce_rows_map: dict[int, List[RecipientRow]] = {}
         rows: List[RecipientRow] = []
         i = 0
-        for r in results:
+        for r in results.rewards:
             raider: RaiderWithAgentDictionary = r["raider"]
             ranking = raider["ranking"]
             avatar_address = raider["address"]
@@ -334,6 +425,9 @@ def save_ranking_rewards(
                 rows.append(row)
                 nonce_rows_map[nonce].append(row)
                 i += 1
+        # every avatar of the season is synced already
+        if not rows:
+            return
         bulk_insert_transactions(rows, nonce_rows_map, time_stamp, db, signer, memo)
 
 
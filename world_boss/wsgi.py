@@ -4,6 +4,8 @@ from fastapi import FastAPI
 from world_boss.app.api import api
 from world_boss.app.config import config
 from world_boss.app.graphql import graphql_app
+from world_boss.app.http_client import aclose_clients
+from world_boss.app.metrics import mark_process_dead
 
 
 def create_app() -> FastAPI:
@@ -15,6 +17,8 @@ def create_app() -> FastAPI:
     fast_api = FastAPI()
     fast_api.include_router(api)
     fast_api.include_router(graphql_app, prefix="/graphql")
+    fast_api.add_event_handler("shutdown", aclose_clients)
+    fast_api.add_event_handler("shutdown", mark_process_dead)
     return fast_api
 
 